@@ -0,0 +1,133 @@
+import os
+import sys
+sys.path.append('libs/')
+import json
+import logging
+from argparse import ArgumentParser
+from libs.srcnn import batch_restoration
+
+
+# Sample call
+"""
+# Restore a folder of videos with 4 workers of 4 threads each
+python3 batch_restore.py --input ../data/videoSRC180_960x540_24_mp4/ --output ../out/SRCNN/ --weights ./model/SRCNN_v1_2X.h5 --scale 2 --workers 4 --threads 4
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Restore many videos or images with a pool of SRCNN workers')
+
+    parser.add_argument(
+        '-input', '--input',
+        type=str, required=True,
+        help='Folder with the low-resolution files'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, required=True,
+        help='Folder to write the restored files'
+    )
+
+    parser.add_argument(
+        '-weights', '--weights',
+        type=str, default='./model/SRCNN_v1_2X.h5',
+        help='Weights of the SRCNN, a frozen graph (.pb) from export.py or an int8 model (.tflite) from quantize.py'
+    )
+
+    parser.add_argument(
+        '-scale', '--scale',
+        type=int, default=2,
+        help='How much should we upscale images'
+    )
+
+    parser.add_argument(
+        '-channels', '--channels',
+        type=int, default=3,
+        help='channels of the model, 1 for luma-only models'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='srcnn upsamples before the network, espcn computes in LR space and upsamples at the end',
+        choices=['srcnn', 'espcn']
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of the model, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-media_type', '--media_type',
+        type=str, default='v',
+        help='Type of media i to image or v to video'
+    )
+
+    parser.add_argument(
+        '-workers', '--workers',
+        type=int, default=2,
+        help='Number of worker processes'
+    )
+
+    parser.add_argument(
+        '-threads', '--threads',
+        type=int, default=None,
+        help='Threads per worker, default is not to limit them'
+    )
+
+    parser.add_argument(
+        '-batch_size', '--batch_size',
+        type=int, default=1,
+        help='Video frames predicted in each forward pass'
+    )
+
+    parser.add_argument(
+        '-qp', '--qp',
+        type=int, default=0,
+        help='crf of the output videos, 0 is the best quality and 51 the worst'
+    )
+
+    parser.add_argument(
+        '-summary', '--summary',
+        type=str, default=None,
+        help='JSON file to write the per-file summary'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    filetypes = ['jpeg', 'png', 'jpg', 'mp4', '264', 'webm', 'wma']
+    lr_paths = []
+    for dirpath, _, filenames in os.walk(args.input):
+        lr_paths += [os.path.join(dirpath, f) for f in filenames
+                     if any(filetype in f.lower() for filetype in filetypes) and not f.endswith('.index.json')]
+
+    model_args = {
+        "upscaling_factor": args.scale,
+        "channels": args.channels,
+        "colorspace": args.colorspace,
+        "architecture": args.architecture,
+        "training_mode": False
+    }
+    predict_args = {"qp": args.qp}
+    if args.media_type == 'v':
+        predict_args["batch_size"] = args.batch_size
+
+    summaries = batch_restoration(
+        lr_paths, args.output, args.weights,
+        model_args=model_args,
+        processes=args.workers,
+        threads=args.threads,
+        media_type=args.media_type,
+        **predict_args
+    )
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summaries, f, indent=4)
@@ -0,0 +1,158 @@
+import os
+import sys
+sys.path.append('libs/')
+import gc
+import tempfile
+from argparse import ArgumentParser
+from libs.benchmarks import RESOLUTIONS, make_images, make_video, bench_loader, bench_training
+from libs.benchmarks import bench_sr_genarator, bench_write_srvideo, write_results
+
+
+# Sample call
+"""
+# Full suite on synthetic data, results in benchmark.json
+python3 benchmark.py --output benchmark.json
+
+# Inference only, on the NumPy engine and keras, comparing two runs
+python3 benchmark.py --suites inference --backends keras numpy --output after.json
+diff before.json after.json
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Throughput benchmarks of the loader, training step and inference on synthetic data')
+
+    parser.add_argument(
+        '-suites', '--suites',
+        type=str, nargs='+', default=['loader', 'training', 'inference'],
+        help='Benchmarks to run',
+        choices=['loader', 'training', 'inference']
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, default='benchmark.json',
+        help='JSON file with the results'
+    )
+
+    parser.add_argument(
+        '-data', '--data',
+        type=str, default=os.path.join(tempfile.gettempdir(), 'srcnn_benchmark'),
+        help='Folder for the synthetic images and videos, reused across runs'
+    )
+
+    parser.add_argument(
+        '-workers', '--workers',
+        type=int, nargs='+', default=[0, 2, 4],
+        help='Loader workers, 0 loads batches in the main process'
+    )
+
+    parser.add_argument(
+        '-crops_per_image', '--crops_per_image',
+        type=int, nargs='+', default=[1, 4],
+        help='Loader crops per image'
+    )
+
+    parser.add_argument(
+        '-batch_sizes', '--batch_sizes',
+        type=int, nargs='+', default=[16, 64],
+        help='Loader batch sizes'
+    )
+
+    parser.add_argument(
+        '-scales', '--scales',
+        type=int, nargs='+', default=[2, 4, 8],
+        help='Upscaling factors of the training benchmark'
+    )
+
+    parser.add_argument(
+        '-resolutions', '--resolutions',
+        type=str, nargs='+', default=['360p', '540p', '1080p'],
+        help='LR resolutions of the inference benchmark',
+        choices=list(RESOLUTIONS)
+    )
+
+    parser.add_argument(
+        '-backends', '--backends',
+        type=str, nargs='+', default=['keras'],
+        help='Inference runtimes of the 2X model',
+        choices=['keras', 'numpy']
+    )
+
+    parser.add_argument(
+        '-weights', '--weights',
+        type=str, default=None,
+        help='2X weights for the inference benchmark, random weights if None'
+    )
+
+    parser.add_argument(
+        '-batches', '--batches',
+        type=int, default=20,
+        help='Batches or steps timed per configuration'
+    )
+
+    parser.add_argument(
+        '-frames', '--frames',
+        type=int, default=10,
+        help='Frames timed per inference configuration'
+    )
+
+    return parser.parse_args()
+
+
+def inference_models(args):
+    """2X models per backend, the numpy engine reads the keras weights"""
+    from srcnn import SRCNN
+    import restore
+    srcnn = SRCNN(upscaling_factor=2, training_mode=False)
+    srcnn.load_weights(weights=args.weights)
+    weights = args.weights
+    if weights is None:
+        weights = os.path.join(args.data, 'SRCNN_random_2X.h5')
+        srcnn.model.save_weights(weights)
+    models = {}
+    for backend in args.backends:
+        if backend == 'keras':
+            models[backend] = srcnn.model
+        else:
+            models[backend] = restore.load_numpy_model(weights, scale=2)
+    return models
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    images = make_images(os.path.join(args.data, 'images'))
+    results = {'config': vars(args), 'loader': [], 'training': [], 'inference': []}
+
+    if 'loader' in args.suites:
+        for workers in args.workers:
+            for crops_per_image in args.crops_per_image:
+                for batch_size in args.batch_sizes:
+                    rate = bench_loader(images, workers, crops_per_image, batch_size, batches=args.batches)
+                    print(">> Loader workers={} crops_per_image={} batch_size={}: {:.2f} batches/s".format(
+                        workers, crops_per_image, batch_size, rate))
+                    results['loader'].append({'workers': workers, 'crops_per_image': crops_per_image,
+                                              'batch_size': batch_size, 'batches_per_sec': rate})
+
+    if 'training' in args.suites:
+        for scale in args.scales:
+            rate = bench_training(images, scale, steps=args.batches)
+            print(">> Training {}X: {:.2f} steps/s".format(scale, rate))
+            results['training'].append({'scale': scale, 'steps_per_sec': rate})
+            gc.collect()
+
+    if 'inference' in args.suites:
+        for backend, model in inference_models(args).items():
+            for resolution in args.resolutions:
+                height, width = RESOLUTIONS[resolution]
+                videopath = make_video(os.path.join(args.data, 'video_{}_{}f.mp4'.format(resolution, args.frames)),
+                                       n_frames=args.frames, height=height, width=width)
+                sr_fps = bench_sr_genarator(model, 2, height, width, frames=args.frames)
+                video_fps = bench_write_srvideo(model, 2, videopath,
+                                                os.path.join(args.data, 'sr_{}_{}.mp4'.format(backend, resolution)))
+                print(">> Inference {} {}: sr_genarator {:.2f} fps, write_srvideo {:.2f} fps".format(
+                    backend, resolution, sr_fps, video_fps))
+                results['inference'].append({'backend': backend, 'resolution': resolution,
+                                             'sr_genarator_fps': sr_fps, 'write_srvideo_fps': video_fps})
+
+    write_results(results, args.output)
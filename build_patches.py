@@ -0,0 +1,88 @@
+import os
+import sys
+sys.path.append('libs/')
+from argparse import ArgumentParser
+from libs.patches import build_patch_store
+
+
+# Sample call
+"""
+# Build a 2X patch store with 16x16 LR crops
+python3 build_patches.py --train ../../data/train_large/ --output ../../data/patches_2X/ --scale 2
+
+# Train from the patch store
+python3 train.py --patch_store ../../data/patches_2X/ --scale 2 --stage default
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Build a memory-mapped patch store for SRCNN training')
+
+    parser.add_argument(
+        '-train', '--train',
+        type=str, default='../../data/train_large/',
+        help='Folder with training images'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, default='../../data/patches/',
+        help='Folder to write the patch shards and index'
+    )
+
+    parser.add_argument(
+        '-scale', '--scale',
+        type=int, default=2,
+        help='How much should we upscale images'
+    )
+
+    parser.add_argument(
+        '-height_lr', '--height_lr',
+        type=int, default=16,
+        help='height of lr crop'
+    )
+
+    parser.add_argument(
+        '-width_lr', '--width_lr',
+        type=int, default=16,
+        help='width of lr crop'
+    )
+
+    parser.add_argument(
+        '-crops_per_image', '--crops_per_image',
+        type=int, default=4,
+        help='Number of random crops taken from each image'
+    )
+
+    parser.add_argument(
+        '-shard_size', '--shard_size',
+        type=int, default=4096,
+        help='Number of patches per shard'
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of images, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-seed', '--seed',
+        type=int, default=None,
+        help='Seed of the crop positions and patch order'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    build_patch_store(
+        args.train, args.output,
+        args.height_lr * args.scale, args.width_lr * args.scale,
+        args.scale,
+        crops_per_image=args.crops_per_image,
+        shard_size=args.shard_size,
+        colorspace=args.colorspace,
+        seed=args.seed
+    )
@@ -0,0 +1,79 @@
+import os
+import sys
+sys.path.append('libs/')
+from argparse import ArgumentParser
+from libs.evaluation import METRICS, pair_files, evaluate, aggregate, write_report
+
+
+# Sample call
+"""
+# Score the SR videos of a restoration run against the HR references
+python3 evaluate.py --sr ../out/540p_2X/ --reference ../data/videoset/1080p/ --output ../out/540p_2X_report
+
+# Pair outputs and references named video_qp_25.mp4 and video.y4m, PSNR only
+python3 evaluate.py --sr ../out/ --reference ../data/hr/ --key_regex "^(.*?)(_qp_\\d+)?\\.[^.]+$" --metrics psnr
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Score SR outputs against their references in parallel, with a results cache')
+
+    parser.add_argument(
+        '-sr', '--sr',
+        type=str, required=True,
+        help='Folder with the SR images or videos'
+    )
+
+    parser.add_argument(
+        '-reference', '--reference',
+        type=str, required=True,
+        help='Folder with the reference images or videos'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, default='./report',
+        help='Report path, written as output.csv and output.json'
+    )
+
+    parser.add_argument(
+        '-cache', '--cache',
+        type=str, default='./.eval_cache.json',
+        help='Results cache keyed by file contents and metric'
+    )
+
+    parser.add_argument(
+        '-metrics', '--metrics',
+        type=str, nargs='+', default=METRICS,
+        help='Metrics to compute',
+        choices=METRICS
+    )
+
+    parser.add_argument(
+        '-key_regex', '--key_regex',
+        type=str, default=None,
+        help='Regex whose first group pairs the file names, default is the name without extension'
+    )
+
+    parser.add_argument(
+        '-workers', '--workers',
+        type=int, default=None,
+        help='Scoring processes, default is the cpu count'
+    )
+
+    parser.add_argument(
+        '-threads', '--threads',
+        type=int, default=1,
+        help='Scoring threads per process'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    pairs = pair_files(args.sr, args.reference, args.key_regex)
+    rows = evaluate(pairs, args.cache, metrics=args.metrics, processes=args.workers, threads=args.threads)
+    summary = aggregate(rows, metrics=args.metrics)
+    print(">> {}".format(summary))
+    write_report(rows, summary, args.output, metrics=args.metrics)
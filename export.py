@@ -0,0 +1,95 @@
+import os
+import sys
+sys.path.append('libs/')
+import gc
+from argparse import ArgumentParser
+from keras import backend as K
+from libs.srcnn import SRCNN
+from libs.frozen import export_frozen
+import restore
+
+
+# Sample call
+"""
+# Export the 2X, 4X and 8X models as frozen graphs next to their weights
+python3 export.py --scales 2 4 8 --weight_path ./model/ --modelname SRCNN_v1
+
+# Export the uint8 native input graph (in-graph bicubic upscale)
+python3 export.py --scales 2 --native
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Export inference-only frozen graphs of SRCNN weights')
+
+    parser.add_argument(
+        '-scales', '--scales',
+        type=int, nargs='+', default=[2, 4, 8],
+        help='Upscaling factors to export, weights are read from weight_path/modelname_{N}X.h5'
+    )
+
+    parser.add_argument(
+        '-weight_path', '--weight_path',
+        type=str, default='./model/',
+        help='Folder with the weights'
+    )
+
+    parser.add_argument(
+        '-modelname', '--modelname',
+        type=str, default='SRCNN_v1',
+        help='SRCNN'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, default=None,
+        help='Folder to write modelname_{N}X.pb, default is weight_path'
+    )
+
+    parser.add_argument(
+        '-channels', '--channels',
+        type=int, default=3,
+        help='channels of the models, 1 for luma-only models'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='srcnn upsamples before the network, espcn computes in LR space and upsamples at the end',
+        choices=['srcnn', 'espcn']
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of the models, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-native', '--native',
+        action='store_true',
+        help='Export the graph taking uint8 LR frames (SRCNN.build_inference_model)'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    output = args.output or args.weight_path
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    # Inference graphs only
+    K.set_learning_phase(0)
+    for scale in args.scales:
+        srcnn = SRCNN(upscaling_factor=scale, channels=args.channels, colorspace=args.colorspace,
+                      architecture=args.architecture, training_mode=False)
+        srcnn.load_weights(os.path.join(args.weight_path, '{}_{}X.h5'.format(args.modelname, scale)))
+        model = srcnn.get_inference_model() if args.native else srcnn.model
+        export_frozen(model, os.path.join(output, '{}_{}X.pb'.format(args.modelname, scale)), scale,
+                      border=srcnn.border, radius=restore.model_radius(srcnn.model))
+        del srcnn, model
+        K.clear_session()
+        K.set_learning_phase(0)
+        gc.collect()
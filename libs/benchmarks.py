@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import platform
+import multiprocessing
+import numpy as np
+import cv2
+from timeit import default_timer as timer
+
+import restore
+
+RESOLUTIONS = {'360p': (360, 640), '540p': (540, 960), '1080p': (1080, 1920)}
+
+
+def synthetic_image(height, width, rng, t=0):
+    """Smooth gradients, edges and noise, so crops and resizes behave like natural images"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    for c in range(3):
+        fy, fx, phase = rng.uniform(0.005, 0.05, 2).tolist() + [rng.uniform(0, np.pi)]
+        img[:, :, c] = 127.5 + 80 * np.sin(fy*y + fx*(x + 4*t) + phase)
+    # Hard edged blocks moving with t
+    for _ in range(8):
+        h, w = rng.integers(height//16, height//4), rng.integers(width//16, width//4)
+        top, left = rng.integers(0, height-h), (rng.integers(0, width-w) + 4*t) % (width-w)
+        img[top:top+h, left:left+w] = rng.uniform(0, 255, 3)
+    img += rng.normal(0, 4, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def make_images(path, n_images=32, height=540, width=960, seed=0):
+    """Write n_images synthetic PNGs to path, reusing the ones already there"""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    rng = np.random.default_rng(seed)
+    for i in range(n_images):
+        img = synthetic_image(height, width, rng)
+        filename = os.path.join(path, 'img_{:04d}.png'.format(i))
+        if not os.path.exists(filename):
+            cv2.imwrite(filename, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+    return path
+
+
+def make_video(path, n_frames=30, height=540, width=960, fps=30, seed=0):
+    """Write a synthetic H.264 video of moving patterns, reusing it when it exists"""
+    if os.path.exists(path):
+        return path
+    import skvideo.io
+    rng = np.random.default_rng(seed)
+    writer = skvideo.io.FFmpegWriter(path, inputdict={'-r': str(fps)},
+        outputdict={'-vcodec': 'libx264', '-crf': '18', '-pix_fmt': 'yuv420p'})
+    state = rng.bit_generator.state
+    for t in range(n_frames):
+        # Same scene every frame, moved by t
+        rng.bit_generator.state = state
+        writer.writeFrame(synthetic_image(height, width, rng, t))
+    writer.close()
+    return path
+
+
+def bench_loader(datapath, workers, crops_per_image, batch_size, batches=20, height_lr=16, width_lr=16, scale=2):
+    """Training batches per second of DataLoader on images, workers=0 loads in this process"""
+    from util import DataLoader
+    loader = DataLoader(datapath, batch_size, height_lr*scale, width_lr*scale, scale, crops_per_image, 'i')
+    if workers == 0:
+        loader.load_batch(idx=0)
+        start = timer()
+        for idx in range(batches):
+            loader.load_batch(idx=idx)
+        return batches / (timer() - start)
+
+    from keras.utils import OrderedEnqueuer
+    enqueuer = OrderedEnqueuer(loader, use_multiprocessing=True)
+    enqueuer.start(workers=workers, max_queue_size=workers*2)
+    try:
+        output = enqueuer.get()
+        # The first batch pays for the worker start up
+        next(output)
+        start = timer()
+        for _ in range(batches):
+            next(output)
+        return batches / (timer() - start)
+    finally:
+        enqueuer.stop()
+
+
+def bench_training(datapath, scale, batch_size=16, steps=20, height_lr=16, width_lr=16):
+    """Training steps per second of SRCNN on one preloaded batch, so only the step is timed"""
+    from keras import backend as K
+    from util import DataLoader
+    from srcnn import SRCNN
+    srcnn = SRCNN(height_lr=height_lr, width_lr=width_lr, upscaling_factor=scale)
+    loader = DataLoader(datapath, batch_size, srcnn.height_hr, srcnn.width_hr, scale, 1, 'i',
+                        border=srcnn.border, pre_upscale=srcnn.pre_upscale)
+    imgs_lr, imgs_hr = loader.load_batch(idx=0)
+    srcnn.model.train_on_batch(imgs_lr, imgs_hr)
+    start = timer()
+    for _ in range(steps):
+        srcnn.model.train_on_batch(imgs_lr, imgs_hr)
+    steps_per_sec = steps / (timer() - start)
+    del srcnn
+    K.clear_session()
+    return steps_per_sec
+
+
+def bench_sr_genarator(model, scale, height, width, frames=5, seed=0):
+    """sr_genarator frames per second on LR frames of height x width"""
+    img_lr = synthetic_image(height, width, np.random.default_rng(seed))
+    restore.sr_genarator(model, img_lr, scale)
+    start = timer()
+    for _ in range(frames):
+        restore.sr_genarator(model, img_lr, scale)
+    return frames / (timer() - start)
+
+
+def bench_write_srvideo(model, scale, videopath, outpath, batch_size=1):
+    """write_srvideo frames per second, decode and encode included"""
+    start = timer()
+    time_elapsed = restore.write_srvideo(model, videopath, outpath, scale, batch_size=batch_size)
+    return len(time_elapsed) / (timer() - start)
+
+
+def environment():
+    """Versions and hardware the numbers were measured on"""
+    env = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+    for name in ['tensorflow', 'keras']:
+        if name in sys.modules:
+            env[name] = sys.modules[name].__version__
+    return env
+
+
+def write_results(results, path):
+    """Results as sorted, indented JSON so two runs diff line by line"""
+    results['environment'] = environment()
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print(">> Benchmark results written to {}".format(path))
@@ -0,0 +1,200 @@
+import os
+import re
+import csv
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+import cv2
+from timeit import default_timer as timer
+
+from metrics import Metrics
+
+VIDEO_TYPES = ['mp4', '264', 'webm', 'wma', 'avi', 'mkv', 'y4m']
+IMAGE_TYPES = ['jpeg', 'png', 'jpg', 'bmp']
+METRICS = ['psnr', 'ssim']
+
+
+def pair_files(sr_path, ref_path, key_regex=None):
+    """Pair the SR outputs with their references by file name without extension,
+    or by the first group of key_regex matched on the file names"""
+    def keys(path):
+        files = {}
+        for f in sorted(os.listdir(path)):
+            if f.lower().split('.')[-1] not in VIDEO_TYPES + IMAGE_TYPES or f.endswith('.index.json'):
+                continue
+            if key_regex:
+                match = re.search(key_regex, f)
+                if match is None:
+                    continue
+                key = match.group(1)
+            else:
+                key = os.path.splitext(f)[0]
+            files[key] = os.path.join(path, f)
+        return files
+    srs, refs = keys(sr_path), keys(ref_path)
+    missing = sorted(set(srs) - set(refs))
+    if missing:
+        print(">> No reference for {} SR files: {}".format(len(missing), missing[:5]))
+    return [(srs[key], refs[key]) for key in sorted(set(srs) & set(refs))]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class ResultsCache():
+    """Scores keyed by the content hashes of the SR and reference files and the metric,
+    kept in a JSON file. File hashes are memoized by path, size and mtime, so
+    unchanged files are not read again."""
+    def __init__(self, path):
+        self.path = path
+        self.data = {'hashes': {}, 'scores': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def stat_key(self, path):
+        st = os.stat(path)
+        return '{}|{}|{}'.format(os.path.abspath(path), st.st_size, int(st.st_mtime_ns))
+
+    def cached_hash(self, path):
+        return self.data['hashes'].get(self.stat_key(path))
+
+    def set_hash(self, path, digest):
+        self.data['hashes'][self.stat_key(path)] = digest
+
+    @staticmethod
+    def score_key(sr_hash, ref_hash, metric):
+        return '{}|{}|{}'.format(sr_hash, ref_hash, metric)
+
+    def get(self, sr_hash, ref_hash, metric):
+        return self.data['scores'].get(self.score_key(sr_hash, ref_hash, metric))
+
+    def put(self, sr_hash, ref_hash, metric, value):
+        self.data['scores'][self.score_key(sr_hash, ref_hash, metric)] = value
+
+    def save(self):
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.rename(tmp, self.path)
+
+
+def _hash_file(path):
+    return path, file_hash(path)
+
+
+def _score_pair(task):
+    """Score one pair in a worker, returning its metrics, frames and seconds"""
+    sr_path, ref_path, metrics, threads = task
+    result = {'sr': sr_path, 'reference': ref_path, 'error': None}
+    start = timer()
+    try:
+        result.update(score_pair(sr_path, ref_path, metrics, threads))
+    except Exception as e:
+        result['error'] = repr(e)
+    result['seconds'] = timer() - start
+    return result
+
+
+def score_pair(sr_path, ref_path, metrics=METRICS, threads=1):
+    """PSNR and/or SSIM of an SR image or video against its reference"""
+    m = Metrics()
+    if sr_path.lower().split('.')[-1] in IMAGE_TYPES:
+        img_sr, img_ref = cv2.imread(sr_path), cv2.imread(ref_path)
+        if img_sr is None or img_ref is None:
+            raise IOError("Error to read {} or {}".format(sr_path, ref_path))
+        result = {'frames': 1}
+        if 'psnr' in metrics:
+            result['psnr'] = m.calculate_psnr(img_sr, img_ref)
+        if 'ssim' in metrics:
+            result['ssim'] = m.calculate_ssim(img_sr, img_ref)
+        return result
+    return m.video_metrics(sr_path, ref_path, metrics=metrics, threads=threads)
+
+
+def evaluate(pairs, cache_path, metrics=METRICS, processes=None, threads=1):
+    """Score the (sr, reference) pairs in worker processes, skipping the metrics of
+    pairs whose file contents are already scored in the cache.
+    Returns the per-file rows in the order of pairs."""
+    cache = ResultsCache(cache_path)
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        # Content hashes, read only for new or modified files
+        paths = sorted(set(path for pair in pairs for path in pair))
+        hashes = {path: cache.cached_hash(path) for path in paths}
+        for path, digest in pool.imap_unordered(_hash_file, [p for p in paths if hashes[p] is None]):
+            hashes[path] = digest
+            cache.set_hash(path, digest)
+
+        rows, tasks = [], []
+        for sr_path, ref_path in pairs:
+            row = {'sr': sr_path, 'reference': ref_path, 'seconds': 0., 'cached': True, 'error': None}
+            for metric in metrics:
+                value = cache.get(hashes[sr_path], hashes[ref_path], metric)
+                if value is None:
+                    row['cached'] = False
+                else:
+                    row['frames'] = value['frames']
+                    row[metric] = value['value']
+            missing = [metric for metric in metrics if metric not in row]
+            if missing:
+                tasks.append((sr_path, ref_path, missing, threads))
+            rows.append(row)
+        print(">> {} pairs, {} to score, {} cached".format(len(pairs), len(tasks), len(pairs) - len(tasks)))
+
+        by_pair = {(row['sr'], row['reference']): row for row in rows}
+        for result in pool.imap_unordered(_score_pair, tasks):
+            row = by_pair[(result['sr'], result['reference'])]
+            row['seconds'] = result['seconds']
+            row['error'] = result['error']
+            if result['error'] is not None:
+                print(">> Failed {}: {}".format(result['sr'], result['error']))
+                continue
+            row['frames'] = result['frames']
+            for metric in metrics:
+                if metric in result:
+                    row[metric] = result[metric]
+                    cache.put(hashes[row['sr']], hashes[row['reference']], metric,
+                              {'value': result[metric], 'frames': result['frames']})
+            # Saved after each pair so an interrupted run keeps its scores
+            cache.save()
+            print(">> {}: {}".format(os.path.basename(row['sr']),
+                  ', '.join('{} {:.4f}'.format(metric, row[metric]) for metric in metrics if metric in row)))
+        cache.save()
+    finally:
+        pool.close()
+        pool.join()
+    return rows
+
+
+def aggregate(rows, metrics=METRICS):
+    """Mean over files and frame-weighted mean of each metric, and the scoring time"""
+    scored = [row for row in rows if row['error'] is None and all(metric in row for metric in metrics)]
+    summary = {'files': len(rows), 'scored': len(scored), 'failed': len(rows) - len(scored),
+               'cached': sum(row['cached'] for row in rows),
+               'frames': int(sum(row['frames'] for row in scored)),
+               'seconds': sum(row['seconds'] for row in rows)}
+    for metric in metrics:
+        values = np.array([row[metric] for row in scored], dtype=np.float64)
+        frames = np.array([row['frames'] for row in scored], dtype=np.float64)
+        summary[metric] = float(values.mean()) if len(values) else float('nan')
+        summary[metric + '_frame_weighted'] = float((values * frames).sum() / frames.sum()) if len(values) else float('nan')
+    return summary
+
+
+def write_report(rows, summary, path, metrics=METRICS):
+    """Per-file rows and the aggregate to path.csv and path.json"""
+    columns = ['sr', 'reference', 'frames'] + list(metrics) + ['seconds', 'cached', 'error']
+    with open(path + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(path + '.json', 'w') as f:
+        json.dump({'summary': summary, 'files': rows}, f, indent=4)
+    print(">> Report written to {0}.csv and {0}.json".format(path))
@@ -0,0 +1,77 @@
+import json
+import numpy as np
+import tensorflow as tf
+
+
+def export_frozen(model, path, scale, border=0, radius=0):
+    """Write an inference-only frozen graph of a keras model to path (.pb) and its
+    metadata to path + '.json'. Variables are folded into constants and everything
+    not needed to compute the output (optimizer, loss, metrics) is dropped."""
+    from keras import backend as K
+    session = K.get_session()
+    input_name = model.input.op.name
+    output_name = model.output.op.name
+    graph_def = tf.compat.v1.graph_util.convert_variables_to_constants(
+        session, session.graph.as_graph_def(), [output_name])
+    graph_def = tf.compat.v1.graph_util.remove_training_nodes(graph_def)
+    with open(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    meta = {
+        'input': input_name + ':0',
+        'output': output_name + ':0',
+        'input_shape': list(model.input_shape),
+        'output_shape': list(model.output_shape),
+        'scale': scale,
+        'border': border,
+        'radius': radius,
+        'upsampling': getattr(model, 'upsampling', 'pre'),
+        'native_input': getattr(model, 'native_input', False)
+    }
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+    print(">> Exported {} ({} nodes)".format(path, len(graph_def.node)))
+    return meta
+
+
+class FrozenModel():
+    """Runs a graph written by export_frozen in its own session, without Keras.
+    Exposes the parts of the keras model API used by restore (predict, input_shape,
+    output_shape) plus the border, radius and upsampling metadata."""
+    def __init__(self, path, threads=None):
+        """
+        :param string path: .pb file written by export_frozen
+        :param int threads: intra-op threads of the session, None for the default
+        """
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        graph_def = tf.compat.v1.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.input = self.graph.get_tensor_by_name(meta['input'])
+        self.output = self.graph.get_tensor_by_name(meta['output'])
+        config = tf.compat.v1.ConfigProto()
+        if threads:
+            config.intra_op_parallelism_threads = threads
+            config.inter_op_parallelism_threads = 1
+        self.session = tf.compat.v1.Session(graph=self.graph, config=config)
+
+        self.input_shape = tuple(meta['input_shape'])
+        self.output_shape = tuple(meta['output_shape'])
+        self.scale = meta['scale']
+        self.border = meta['border']
+        self.radius = meta['radius']
+        self.upsampling = meta['upsampling']
+        self.native_input = meta['native_input']
+        self.layers = []
+
+    def predict(self, x, batch_size=None):
+        if not batch_size or len(x) <= batch_size:
+            return self.session.run(self.output, {self.input: x})
+        return np.concatenate([self.session.run(self.output, {self.input: x[i:i+batch_size]})
+                               for i in range(0, len(x), batch_size)])
+
+    def close(self):
+        self.session.close()
@@ -9,6 +9,8 @@ from keras.applications.vgg19 import VGG19
 from keras.utils import data_utils as keras_utils
 from keras.applications.vgg19 import preprocess_input
 from skimage.measure import compare_psnr
+# PSNR and SSIM of images and videos, kept free of tensorflow for the evaluation tools
+from metrics import Metrics
 
 class VGGLossNoActivation(object):
     """By ESRGAN a more effective perceptual loss constraining on features before activation rather than 
@@ -92,98 +94,6 @@ class VGGLoss(object):
         return (1. * K.mean(K.square(self.model(self.preprocess_vgg(y_true)) - self.model(self.preprocess_vgg(y_pred)))) + K.mean(K.square(y_pred - y_true), axis=None))
 
 
-class Metrics():
-    def __init__(self,use_gpu=True):
-        '''
-        net - ['squeeze','alex','vgg']
-        '''
-
-    def psnr_video(self,videopath1, videopath2):
-        cap1 = cv2.VideoCapture(videopath1)
-        cap2 = cv2.VideoCapture(videopath2)
-        psnr_values = []
-        while(cap1.isOpened() and cap2.isOpened()):
-            ret1, frame1 = cap1.read()
-            ret2, frame2 = cap2.read()
-            if(ret1 and ret2):
-                psnr_values.append(self.calculate_psnr(frame1, frame2))        
-            else:
-                break
-        cap1.release()
-        cap2.release()
-        return np.mean(psnr_values)
-    
-    def ssim_video(self,videopath1, videopath2):
-        cap1 = cv2.VideoCapture(videopath1)
-        cap2 = cv2.VideoCapture(videopath2)
-        ssim_values = []
-        while(cap1.isOpened() and cap2.isOpened()):
-            ret1, frame1 = cap1.read()
-            ret2, frame2 = cap2.read()
-            if(ret1 and ret2):
-                ssim_values.append(self.calculate_ssim(frame1, frame2))        
-            else:
-                break
-        cap1.release()
-        cap2.release()
-        return np.mean(ssim_values)
-
-    # Calculate psnr between two images
-    def calculate_psnr(self,img1, img2):
-        # img1 and img2 have range [0, 255]
-        img1 = img1.astype(np.float64)
-        img2 = img2.astype(np.float64)
-        mse = np.mean((img1 - img2)**2)
-        if mse == 0:
-            return float('inf')
-        return 20 * math.log10(255.0 / math.sqrt(mse))
-
-
-    # Aux to Calculate psnr between two images
-    def ssim(self,img1, img2):
-        C1 = (0.01 * 255)**2
-        C2 = (0.03 * 255)**2
-
-        img1 = img1.astype(np.float64)
-        img2 = img2.astype(np.float64)
-        kernel = cv2.getGaussianKernel(11, 1.5)
-        window = np.outer(kernel, kernel.transpose())
-
-        mu1 = cv2.filter2D(img1, -1, window)[5:-5, 5:-5]  # valid
-        mu2 = cv2.filter2D(img2, -1, window)[5:-5, 5:-5]
-        mu1_sq = mu1**2
-        mu2_sq = mu2**2
-        mu1_mu2 = mu1 * mu2
-        sigma1_sq = cv2.filter2D(img1**2, -1, window)[5:-5, 5:-5] - mu1_sq
-        sigma2_sq = cv2.filter2D(img2**2, -1, window)[5:-5, 5:-5] - mu2_sq
-        sigma12 = cv2.filter2D(img1 * img2, -1, window)[5:-5, 5:-5] - mu1_mu2
-
-        ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) *
-                                                                (sigma1_sq + sigma2_sq + C2))
-        return ssim_map.mean()
-
-    # Calculate ssim between two images
-    def calculate_ssim(self,img1, img2):
-        '''calculate SSIM
-        the same outputs as MATLAB's
-        img1, img2: [0, 255]
-        '''
-        if not img1.shape == img2.shape:
-            raise ValueError('Input images must have the same dimensions.')
-        if img1.ndim == 2:
-            return self.ssim(img1, img2)
-        elif img1.ndim == 3:
-            if img1.shape[2] == 3:
-                ssims = []
-                for i in range(3):
-                    ssims.append(self.ssim(img1, img2))
-                return np.array(ssims).mean()
-            elif img1.shape[2] == 1:
-                return self.ssim(np.squeeze(img1), np.squeeze(img2))
-        else:
-            raise ValueError('Wrong input image dimensions.')
-
-
 def unscale_hr_imgs(x):
     """Take a HR image [0, 1], convert to [0, 255]"""
     if isinstance(x, np.ndarray):
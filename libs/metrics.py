@@ -0,0 +1,178 @@
+import cv2
+import math
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Metrics():
+    def __init__(self,use_gpu=True):
+        '''
+        net - ['squeeze','alex','vgg']
+        '''
+
+    def psnr_video(self,videopath1, videopath2, **kwargs):
+        return self.video_metrics(videopath1, videopath2, metrics=['psnr'], **kwargs)['psnr']
+    
+    def ssim_video(self,videopath1, videopath2, **kwargs):
+        return self.video_metrics(videopath1, videopath2, metrics=['ssim'], **kwargs)['ssim']
+
+    @staticmethod
+    def read_batches(videopath, out, batch_size, stop):
+        """Decode videopath in batches of frames into the out queue, None when done"""
+        cap = cv2.VideoCapture(videopath)
+        try:
+            batch = []
+            while cap.isOpened() and not stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                batch.append(frame)
+                if len(batch) == batch_size:
+                    out.put(batch)
+                    batch = []
+            if batch:
+                out.put(batch)
+        finally:
+            cap.release()
+            out.put(None)
+
+    def video_metrics(self, videopath1, videopath2, metrics=('psnr', 'ssim'), batch_size=8, threads=None, queue_size=4, strip=256):
+        """Mean per frame PSNR and/or SSIM of two videos in a single pass.
+        Both videos are decoded by background threads and each batch of frame pairs
+        is scored by a thread pool, SSIM in strips of rows of each channel.
+        Returns a dict with the requested metrics and the number of frames compared."""
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)]
+        readers = [threading.Thread(target=self.read_batches, args=(path, q, batch_size, stop))
+                   for path, q in zip([videopath1, videopath2], queues)]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        values = {metric: [] for metric in metrics}
+        pool = ThreadPoolExecutor(threads)
+        try:
+            while True:
+                batch1, batch2 = queues[0].get(), queues[1].get()
+                if batch1 is None or batch2 is None:
+                    break
+                n = min(len(batch1), len(batch2))
+                if 'psnr' in values:
+                    values['psnr'].extend(pool.map(self.calculate_psnr, batch1[:n], batch2[:n]))
+                if 'ssim' in values:
+                    values['ssim'].extend(self.batch_ssim(batch1[:n], batch2[:n], pool, strip))
+                if len(batch1) != len(batch2):
+                    break
+        finally:
+            stop.set()
+            pool.shutdown()
+            # Unblock readers waiting on a full queue
+            for q, reader in zip(queues, readers):
+                while reader.is_alive():
+                    try:
+                        q.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+        result = {metric: float(np.mean(v)) if v else float('nan') for metric, v in values.items()}
+        result['frames'] = len(next(iter(values.values()))) if values else 0
+        return result
+
+    def batch_ssim(self, frames1, frames2, pool, strip=256):
+        """SSIM of each frame pair, averaged over channels, from strips of rows scored in the pool"""
+        tasks = []
+        for i, (frame1, frame2) in enumerate(zip(frames1, frames2)):
+            if frame1.shape != frame2.shape:
+                raise ValueError('Input images must have the same dimensions.')
+            channels1, channels2 = cv2.split(frame1), cv2.split(frame2)
+            height = frame1.shape[0]
+            for c in range(len(channels1)):
+                # Rows [top, bottom) of the valid SSIM map, with the 5 rows of context on each side
+                for top in range(5, height - 5, strip):
+                    bottom = min(top + strip, height - 5)
+                    tasks.append((i, c, channels1[c][top-5:bottom+5], channels2[c][top-5:bottom+5]))
+        sums = list(pool.map(lambda task: self.ssim_sum(task[2], task[3]), tasks))
+
+        totals = np.zeros((len(frames1), frames1[0].shape[2] if frames1[0].ndim == 3 else 1, 2))
+        for (i, c, _, _), (total, count) in zip(tasks, sums):
+            totals[i, c] += (total, count)
+        return list((totals[:, :, 0] / totals[:, :, 1]).mean(axis=1))
+
+    @staticmethod
+    def ssim_sum(img1, img2):
+        """Sum and size of the valid SSIM map of two single channel images, as ssim() computes it
+        with the separable Gaussian blur"""
+        C1 = (0.01 * 255)**2
+        C2 = (0.03 * 255)**2
+
+        img1 = img1.astype(np.float64)
+        img2 = img2.astype(np.float64)
+        blur = lambda img: cv2.GaussianBlur(img, (11, 11), 1.5)[5:-5, 5:-5]
+
+        mu1 = blur(img1)
+        mu2 = blur(img2)
+        mu1_sq = mu1**2
+        mu2_sq = mu2**2
+        mu1_mu2 = mu1 * mu2
+        sigma1_sq = blur(img1**2) - mu1_sq
+        sigma2_sq = blur(img2**2) - mu2_sq
+        sigma12 = blur(img1 * img2) - mu1_mu2
+
+        ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) *
+                                                                (sigma1_sq + sigma2_sq + C2))
+        return ssim_map.sum(), ssim_map.size
+
+    # Calculate psnr between two images
+    def calculate_psnr(self,img1, img2):
+        # img1 and img2 have range [0, 255], squared error summed by OpenCV without float copies
+        mse = cv2.norm(img1, img2, cv2.NORM_L2SQR) / img1.size
+        if mse == 0:
+            return float('inf')
+        return 20 * math.log10(255.0 / math.sqrt(mse))
+
+
+    # Aux to Calculate psnr between two images
+    def ssim(self,img1, img2):
+        C1 = (0.01 * 255)**2
+        C2 = (0.03 * 255)**2
+
+        img1 = img1.astype(np.float64)
+        img2 = img2.astype(np.float64)
+        kernel = cv2.getGaussianKernel(11, 1.5)
+        window = np.outer(kernel, kernel.transpose())
+
+        mu1 = cv2.filter2D(img1, -1, window)[5:-5, 5:-5]  # valid
+        mu2 = cv2.filter2D(img2, -1, window)[5:-5, 5:-5]
+        mu1_sq = mu1**2
+        mu2_sq = mu2**2
+        mu1_mu2 = mu1 * mu2
+        sigma1_sq = cv2.filter2D(img1**2, -1, window)[5:-5, 5:-5] - mu1_sq
+        sigma2_sq = cv2.filter2D(img2**2, -1, window)[5:-5, 5:-5] - mu2_sq
+        sigma12 = cv2.filter2D(img1 * img2, -1, window)[5:-5, 5:-5] - mu1_mu2
+
+        ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) *
+                                                                (sigma1_sq + sigma2_sq + C2))
+        return ssim_map.mean()
+
+    # Calculate ssim between two images
+    def calculate_ssim(self,img1, img2):
+        '''calculate SSIM
+        the same outputs as MATLAB's
+        img1, img2: [0, 255]
+        '''
+        if not img1.shape == img2.shape:
+            raise ValueError('Input images must have the same dimensions.')
+        if img1.ndim == 2:
+            return self.ssim(img1, img2)
+        elif img1.ndim == 3:
+            if img1.shape[2] == 3:
+                ssims = []
+                for i in range(3):
+                    ssims.append(self.ssim(img1[:,:,i], img2[:,:,i]))
+                return np.array(ssims).mean()
+            elif img1.shape[2] == 1:
+                return self.ssim(np.squeeze(img1), np.squeeze(img2))
+        else:
+            raise ValueError('Wrong input image dimensions.')
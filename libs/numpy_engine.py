@@ -0,0 +1,107 @@
+import h5py
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import as_strided
+
+
+def load_h5_weights(path):
+    """Kernels and biases of the layers with weights, in model order, from a keras .h5 file
+    (save_weights or a full model save)"""
+    weights = []
+    with h5py.File(path, 'r') as f:
+        group = f['model_weights'] if 'model_weights' in f else f
+        for name in group.attrs['layer_names']:
+            name = name.decode('utf8') if isinstance(name, bytes) else name
+            layer = group[name]
+            names = [n.decode('utf8') if isinstance(n, bytes) else n for n in layer.attrs['weight_names']]
+            if not names:
+                continue
+            values = {n.split('/')[-1].split(':')[0]: np.asarray(layer[n], dtype=np.float32) for n in names}
+            weights.append((name, values['kernel'], values.get('bias')))
+    return weights
+
+
+def conv2d_valid(x, kernel, bias):
+    """Valid cross-correlation of x (h, w, cin) with a keras kernel (kh, kw, cin, cout)"""
+    kh, kw, cin, cout = kernel.shape
+    h, w = x.shape[0] - kh + 1, x.shape[1] - kw + 1
+    if kh == 1 and kw == 1:
+        out = x.reshape(-1, cin).dot(kernel.reshape(cin, cout))
+    elif kh * kw * cin <= 512:
+        # im2col, one matmul: (h*w, kh*kw*cin) x (kh*kw*cin, cout)
+        x = np.ascontiguousarray(x)
+        sy, sx, sc = x.strides
+        cols = as_strided(x, shape=(h, w, kh, kw, cin), strides=(sy, sx, sy, sx, sc), writeable=False)
+        cols = np.ascontiguousarray(cols).reshape(h * w, kh * kw * cin)
+        out = cols.dot(kernel.reshape(kh * kw * cin, cout))
+    else:
+        # Wide inputs: accumulate one matmul per kernel tap instead of a huge im2col
+        out = np.zeros((h * w, cout), dtype=np.float32)
+        for dy in range(kh):
+            for dx in range(kw):
+                out += np.ascontiguousarray(x[dy:dy+h, dx:dx+w]).reshape(-1, cin).dot(kernel[dy, dx])
+    if bias is not None:
+        out += bias
+    return out.reshape(h, w, cout)
+
+
+class NumpySRCNN():
+    """SRCNN inference (conv9x9-ReLU-conv1x1-ReLU-conv5x5, valid padding) in NumPy
+    from the .h5 weights, without TensorFlow. Frames are split in tiles that are run
+    by a thread pool, the matmuls release the GIL.
+    Exposes the parts of the keras model API used by restore (predict, input_shape,
+    output_shape) so it is a drop-in model for restore.sr_genarator."""
+    def __init__(self, path, scale=None, threads=None, tile_size=128):
+        """
+        :param string path: .h5 weights of an SRCNN (architecture='srcnn'), other layouts raise a ValueError
+        :param int scale: upscaling factor of the weights, only informative
+        :param int threads: threads running the tiles, None for the cpu count
+        :param int tile_size: output tile side in pixels
+        """
+        self.weights = load_h5_weights(path)
+        kernels = [kernel.shape for _, kernel, _ in self.weights]
+        if ([shape[:2] for shape in kernels] != [(9, 9), (1, 1), (5, 5)]
+                or kernels[0][3] != kernels[1][2] or kernels[1][3] != kernels[2][2]
+                or kernels[2][3] != kernels[0][2]):
+            raise ValueError("{} is not an SRCNN model, got layers {}".format(
+                path, [(name, kernel.shape) for name, kernel, _ in self.weights]))
+        channels = self.weights[0][1].shape[2]
+        self.scale = scale
+        self.border = sum((kernel.shape[0] - 1) // 2 for _, kernel, _ in self.weights)
+        self.radius = self.border
+        self.upsampling = 'pre'
+        self.native_input = False
+        self.input_shape = (None, None, None, channels)
+        self.output_shape = (None, None, None, self.weights[-1][1].shape[3])
+        self.layers = []
+        self.tile_size = tile_size
+        self.pool = ThreadPoolExecutor(threads)
+
+    def forward(self, x):
+        """Valid-padding forward pass of one (h, w, c) float32 input"""
+        for i, (_, kernel, bias) in enumerate(self.weights):
+            x = conv2d_valid(x, kernel, bias)
+            if i < len(self.weights) - 1:
+                np.maximum(x, 0, out=x)
+        return x
+
+    def predict_image(self, img):
+        img = np.asarray(img, dtype=np.float32)
+        b = self.border
+        h, w = img.shape[0] - 2*b, img.shape[1] - 2*b
+        out = np.empty((h, w, self.output_shape[-1]), dtype=np.float32)
+
+        def run(tile):
+            y, x = tile
+            out[y:y+self.tile_size, x:x+self.tile_size] = self.forward(
+                img[y:y+self.tile_size+2*b, x:x+self.tile_size+2*b])
+
+        tiles = [(y, x) for y in range(0, h, self.tile_size) for x in range(0, w, self.tile_size)]
+        list(self.pool.map(run, tiles))
+        return out
+
+    def predict(self, x, batch_size=None):
+        return np.array([self.predict_image(img) for img in x])
+
+    def close(self):
+        self.pool.shutdown()
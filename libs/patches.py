@@ -0,0 +1,137 @@
+import os
+import json
+import numpy as np
+import cv2
+from keras.utils import Sequence
+from util import DataLoader
+
+
+def build_patch_store(datapath, outpath, height_hr, width_hr, scale,
+        crops_per_image=4, shard_size=4096, colorspace='RGB', seed=None):
+    """Write random HR crops and their bicubic LR versions as uint8 .npy shards
+    :param string datapath: folder with training images
+    :param string outpath: folder to write the shards and index.json
+    :param int shard_size: number of patches per shard
+    :param int seed: seed of the image order, crop positions and patch order, the same seed
+        writes the same store
+    """
+    if not os.path.isdir(outpath):
+        os.makedirs(outpath)
+    rng = np.random.RandomState(seed)
+
+    # Reuse the loader to list the images and take the crops
+    loader = DataLoader(datapath, 1, height_hr, width_hr, scale, crops_per_image, 'i', 3, colorspace)
+    img_paths = [loader.img_paths[i] for i in rng.permutation(loader.total_imgs)]
+    lr_shape = (int(width_hr / scale), int(height_hr / scale))
+    hr_shape = (width_hr, height_hr)
+
+    index = {
+        'height_hr': height_hr, 'width_hr': width_hr,
+        'scale': scale, 'colorspace': colorspace,
+        'total': 0, 'shards': []
+    }
+    imgs_hr, imgs_lr = [], []
+
+    def write_shard():
+        order = rng.permutation(len(imgs_hr))
+        name = 'shard_{:05d}'.format(len(index['shards']))
+        np.save(os.path.join(outpath, name + '_hr.npy'), np.array(imgs_hr, dtype=np.uint8)[order])
+        np.save(os.path.join(outpath, name + '_lr.npy'), np.array(imgs_lr, dtype=np.uint8)[order])
+        index['shards'].append({'hr': name + '_hr.npy', 'lr': name + '_lr.npy', 'count': len(imgs_hr)})
+        index['total'] += len(imgs_hr)
+        print(">> Wrote {} with {} patches".format(name, len(imgs_hr)))
+        del imgs_hr[:], imgs_lr[:]
+
+    for path in img_paths:
+        try:
+            img = loader.load_img(path, colorspace)
+            for _ in range(crops_per_image):
+                img_hr = loader.random_crop(img, (height_hr, width_hr), rng)
+                img_lr = cv2.resize(img_hr, lr_shape, interpolation = cv2.INTER_CUBIC)
+                img_lr = cv2.resize(img_lr, hr_shape, interpolation = cv2.INTER_CUBIC)
+                imgs_hr.append(img_hr)
+                imgs_lr.append(img_lr)
+        except Exception as e:
+            print(e)
+        if len(imgs_hr) >= shard_size:
+            write_shard()
+    if len(imgs_hr):
+        write_shard()
+
+    with open(os.path.join(outpath, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=4)
+    print(">> Patch store with {} patches in {}".format(index['total'], outpath))
+    return index
+
+
+class PatchDataset(Sequence):
+    """Training batches read from a patch store written by build_patch_store.
+    Shards are memory-mapped, so a batch is a contiguous page-cache read."""
+    def __init__(self, storepath, batch_size, channels=3, border=6, pre_upscale=True):
+        """
+        :param string storepath: folder with the shards and index.json
+        :param int batch_size: number of patches per batch
+        :param int channels: number of channels fed to the network
+        :param int border: pixels per side trimmed from the HR targets
+        :param bool pre_upscale: feed the stored bicubic upscaled LR patches, False to
+            downscale the HR patches to LR size instead (post-upsampling models)
+        """
+        self.storepath = storepath
+        self.batch_size = batch_size
+        self.channels = channels
+        self.border = border
+        self.pre_upscale = pre_upscale
+        with open(os.path.join(storepath, 'index.json')) as f:
+            self.index = json.load(f)
+        self.height_hr = self.index['height_hr']
+        self.width_hr = self.index['width_hr']
+        self.scale = self.index['scale']
+        self.colorspace = self.index['colorspace']
+        self.total_imgs = self.index['total']
+        self.offsets = np.cumsum([0] + [shard['count'] for shard in self.index['shards']])
+        self.shards = None
+        print(">> Found {} patches in patch store".format(self.total_imgs))
+
+    def __getstate__(self):
+        # Memory maps are reopened by each worker
+        state = self.__dict__.copy()
+        state['shards'] = None
+        return state
+
+    def open_shards(self):
+        self.shards = [
+            (np.load(os.path.join(self.storepath, shard['lr']), mmap_mode='r'),
+             np.load(os.path.join(self.storepath, shard['hr']), mmap_mode='r'))
+            for shard in self.index['shards']]
+
+    def __len__(self):
+        return int(self.total_imgs / float(self.batch_size))
+
+    def __getitem__(self, idx):
+        return self.load_batch(idx)
+
+    def load_batch(self, idx=0):
+        if self.shards is None:
+            self.open_shards()
+        start = (idx * self.batch_size) % self.total_imgs
+        imgs_lr, imgs_hr = [], []
+        count = 0
+        while count < self.batch_size:
+            # Read a contiguous run of patches from the shard holding start
+            s = np.searchsorted(self.offsets, start, side='right') - 1
+            begin = start - self.offsets[s]
+            end = min(begin + self.batch_size - count, self.offsets[s+1] - self.offsets[s])
+            shard_lr, shard_hr = self.shards[s]
+            if self.pre_upscale:
+                imgs_lr.append(shard_lr[begin:end, :, :, :self.channels])
+            else:
+                lr_shape = (self.width_hr // self.scale, self.height_hr // self.scale)
+                imgs_lr.append(np.array([cv2.resize(img_hr, lr_shape, interpolation = cv2.INTER_CUBIC)
+                                         for img_hr in shard_hr[begin:end]])[..., :self.channels])
+            imgs_hr.append(shard_hr[begin:end, self.border:self.height_hr-self.border,
+                                    self.border:self.width_hr-self.border, :self.channels])
+            count += end - begin
+            start = (start + end - begin) % self.total_imgs
+        imgs_lr = DataLoader.scale_lr_imgs(np.concatenate(imgs_lr).astype(np.float32))
+        imgs_hr = DataLoader.scale_hr_imgs(np.concatenate(imgs_hr).astype(np.float32))
+        return imgs_lr, imgs_hr
@@ -0,0 +1,121 @@
+import os
+import json
+import numpy as np
+import tensorflow as tf
+from timeit import default_timer as timer
+from keras import backend as K
+from keras.layers import Input
+from keras.models import Model
+
+import restore
+from losses import psnr2 as psnr
+
+
+def quantize_model(srcnn, loader, path, batches=10):
+    """Post-training int8 quantization of an SRCNN with TFLite.
+    Activation ranges are calibrated on batches drawn from loader (an image DataLoader
+    with the training crops of the model, whose shape the converter input is fixed to), weights and activations are int8 and the model
+    keeps float inputs and outputs so restore can feed it as the keras model.
+    Writes path (.tflite) and its metadata to path + '.json'."""
+    # TFLite needs a static input shape for the conversion, frames are resized at runtime
+    if loader.media_type != 'i':
+        raise ValueError('Calibration needs an image DataLoader, video batches do not match the converter input shape')
+    lr_shape = loader.batch_buffers()[0].shape[1:]
+    inputs = Input(shape=lr_shape)
+    model = Model(inputs=inputs, outputs=srcnn.model(inputs))
+
+    def representative_dataset():
+        for idx in range(batches):
+            imgs_lr, _ = loader.load_batch(idx=idx)
+            for img_lr in imgs_lr:
+                yield [img_lr[np.newaxis].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_session(K.get_session(), [model.input], [model.output])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+    meta = {
+        'input_shape': [None, None, None, srcnn.channels],
+        'output_shape': [None, None, None, srcnn.channels],
+        'scale': srcnn.upscaling_factor,
+        'border': srcnn.border,
+        'radius': restore.model_radius(srcnn.model),
+        'upsampling': getattr(srcnn.model, 'upsampling', 'pre'),
+        'native_input': False
+    }
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+    print(">> Quantized model written to {}".format(path))
+    return meta
+
+
+class QuantizedModel():
+    """Runs an int8 TFLite model from quantize_model with the parts of the keras
+    model API used by restore (predict, input_shape, output_shape)"""
+    def __init__(self, path, threads=None):
+        """
+        :param string path: .tflite file written by quantize_model
+        :param int threads: interpreter threads, None for the default
+        """
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        try:
+            self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        except TypeError:
+            # if you have older version of tensorflow
+            self.interpreter = tf.lite.Interpreter(model_path=path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.shape = None
+
+        self.input_shape = tuple(meta['input_shape'])
+        self.output_shape = tuple(meta['output_shape'])
+        self.scale = meta['scale']
+        self.border = meta['border']
+        self.radius = meta['radius']
+        self.upsampling = meta['upsampling']
+        self.native_input = meta['native_input']
+        self.layers = []
+
+    def predict(self, x, batch_size=None):
+        outputs = []
+        for img in x:
+            img = img[np.newaxis].astype(np.float32)
+            if img.shape != self.shape:
+                self.interpreter.resize_tensor_input(self.input_index, img.shape)
+                self.interpreter.allocate_tensors()
+                self.shape = img.shape
+            self.interpreter.set_tensor(self.input_index, img)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self.output_index)[0].copy())
+        return np.array(outputs)
+
+
+def compare_models(model, qmodel, loader, datapath_test):
+    """PSNR (psnr2) and inference time of the float and the int8 model on the test images"""
+    test_paths = [os.path.join(datapath_test, f) for f in sorted(os.listdir(datapath_test)) if any(filetype in f.lower() for filetype in ['jpeg','mp4','264', 'png', 'jpg']) and not f.endswith('.index.json')]
+    imgs_lr, imgs_hr = loader.load_batch(img_paths=test_paths, training=False, bicubic=True)
+    # Untimed first call, so graph setup and the interpreter allocation are not charged to the first image
+    if len(imgs_lr):
+        for m in [model, qmodel]:
+            m.predict(imgs_lr[0][np.newaxis], batch_size=1)
+    report = {'images': [], 'float_psnr': 0., 'int8_psnr': 0., 'float_time': 0., 'int8_time': 0.}
+    for img_lr, img_hr, img_path in zip(imgs_lr, imgs_hr, test_paths):
+        img_hr = restore.unscale_hr_imgs(img_hr)
+        result = {'file': img_path}
+        for name, m in [('float', model), ('int8', qmodel)]:
+            start = timer()
+            img_sr = m.predict(img_lr[np.newaxis], batch_size=1)[0]
+            result[name + '_time'] = timer() - start
+            result[name + '_psnr'] = psnr(restore.unscale_hr_imgs(img_sr), img_hr, 255.)
+        report['images'].append(result)
+    for key in ['float_psnr', 'int8_psnr', 'float_time', 'int8_time']:
+        report[key] = float(np.mean([result[key] for result in report['images']]))
+    report['psnr_change'] = report['int8_psnr'] - report['float_psnr']
+    report['speedup'] = report['float_time'] / report['int8_time'] if report['int8_time'] else 0.
+    print(">> PSNR float {:.2f}dB, int8 {:.2f}dB ({:+.2f}dB) - speedup {:.2f}x".format(
+        report['float_psnr'], report['int8_psnr'], report['psnr_change'], report['speedup']))
+    return report
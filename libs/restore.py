@@ -1,13 +1,11 @@
 import math
-import imageio
-import skvideo.io
+import queue
+import threading
 import numpy as np
 import cv2
 
-from tqdm import tqdm
 from PIL import Image
 from timeit import default_timer as timer
-from util import DataLoader
 
 def selectBetterBitrate(height, fps):   
     #print(height,fps)
@@ -57,21 +55,149 @@ def unscale_hr_imgs(imgs):
     return imgs.astype('uint8')
     
 
-def sr_genarator(model,img_lr,scale):
+def sr_genarator(model,img_lr,scale,tile_size=None):
     """Predict sr frame given a LR frame"""
-    # Predict high-resolution version (add batch dimension to image)
-    img_lr = cv2.resize(img_lr,(img_lr.shape[1]*scale,img_lr.shape[0]*scale), interpolation = cv2.INTER_CUBIC)
-    img_lr = scale_lr_imgs(img_lr)
-    img_sr = model.predict(np.expand_dims(img_lr, 0))
-    img_sr = unscale_hr_imgs(img_sr)    
-    # Remove batch dimension
-    img_sr = img_sr.reshape(img_sr.shape[1], img_sr.shape[2], img_sr.shape[3])
+    return sr_batch_genarator(model,[img_lr],scale,tile_size=tile_size)[0]
+
+def model_border(model):
+    """Pixels trimmed per side by the valid-padding convolutions of the model"""
+    if hasattr(model, 'border'):
+        return model.border
+    border = 0
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            border += model_border(layer)
+        elif getattr(layer, 'padding', None) == 'valid' and hasattr(layer, 'kernel_size'):
+            border += (layer.kernel_size[0] - 1) // 2
+    return border
+
+def load_frozen_model(path, threads=None):
+    """Load a graph written by export.py, usable wherever restore takes a model"""
+    from frozen import FrozenModel
+    return FrozenModel(path, threads=threads)
+
+def load_quantized_model(path, threads=None):
+    """Load an int8 model written by quantize.py, usable wherever restore takes a model"""
+    from quantization import QuantizedModel
+    return QuantizedModel(path, threads=threads)
+
+def load_numpy_model(path, scale=None, threads=None, tile_size=128):
+    """Load .h5 SRCNN weights in the NumPy engine, usable wherever restore takes a model
+    and without TensorFlow"""
+    from numpy_engine import NumpySRCNN
+    return NumpySRCNN(path, scale=scale, threads=threads, tile_size=tile_size)
+
+def model_radius(model):
+    """Receptive field radius of the model in input pixels, whatever the padding"""
+    if hasattr(model, 'radius'):
+        return model.radius
+    radius = 0
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            radius += model_radius(layer)
+        elif hasattr(layer, 'kernel_size'):
+            radius += (layer.kernel_size[0] - 1) // 2
+    return radius
+
+def is_post_upsampling(model):
+    """Post-upsampling models (SRCNN architecture='espcn') take LR frames without bicubic pre-upscaling"""
+    return getattr(model, 'upsampling', 'pre') == 'post'
+
+def is_native_model(model):
+    """Models from SRCNN.build_inference_model take uint8 LR frames and return uint8 SR frames"""
+    return getattr(model, 'native_input', False)
+
+def is_luma_model(model):
+    """Models with a single input channel super-resolve the Y channel only"""
+    return model.input_shape[-1] == 1
+
+def predict_tiled(model,img_hr,tile_size,border=None):
+    """Predict the sr frame of a bicubic upscaled uint8 frame tile by tile.
+    Each output tile of tile_size x tile_size is predicted from the input tile
+    grown by the model border on every side, so the stitched frame matches the
+    full frame prediction while memory only depends on the tile size."""
+    if border is None:
+        border = model_border(model)
+    height, width = img_hr.shape[0] - 2*border, img_hr.shape[1] - 2*border
+    img_sr = np.empty((height, width, model.output_shape[-1]), dtype=np.uint8)
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            tile_h, tile_w = min(tile_size, height - y), min(tile_size, width - x)
+            tile = img_hr[y:y+tile_h+2*border, x:x+tile_w+2*border]
+            pred = model.predict(scale_lr_imgs(tile[np.newaxis]), batch_size=1)
+            img_sr[y:y+tile_h, x:x+tile_w] = unscale_hr_imgs(pred[0])
     return img_sr
-    
-def write_srvideo(model=None,lr_videopath=None,sr_videopath=None,scale=None,print_frequency=False,crf=15,fps=None,gpu=False):
-    """Generate SR video given LR video """
+
+def predict_tiled_post(model,img_lr,tile_size,scale):
+    """Predict the sr frame of an uint8 LR frame tile by tile with a post-upsampling model.
+    LR tiles are grown by the receptive field radius of the model (clamped at the frame
+    edges) and the output of that margin is dropped, so the stitched frame matches the
+    full frame prediction."""
+    margin = model_radius(model)
+    step = max(tile_size // scale, 1)
+    height, width = img_lr.shape[0], img_lr.shape[1]
+    img_sr = np.empty((height*scale, width*scale, model.output_shape[-1]), dtype=np.uint8)
+    for y in range(0, height, step):
+        for x in range(0, width, step):
+            tile_h, tile_w = min(step, height - y), min(step, width - x)
+            y0, x0 = max(y - margin, 0), max(x - margin, 0)
+            tile = img_lr[y0:min(y+tile_h+margin, height), x0:min(x+tile_w+margin, width)]
+            pred = model.predict(scale_lr_imgs(tile[np.newaxis]), batch_size=1)[0]
+            pred = pred[(y-y0)*scale:(y-y0+tile_h)*scale, (x-x0)*scale:(x-x0+tile_w)*scale]
+            img_sr[y*scale:(y+tile_h)*scale, x*scale:(x+tile_w)*scale] = unscale_hr_imgs(pred)
+    return img_sr
+
+def prepare_batch(model,imgs_lr,scale,tile_size=None):
+    """Bicubic upscale a list of RGB LR frames into the network input.
+    For luma models the frames are converted to YCrCb, only Y goes to the network
+    and the upscaled chroma (cropped by the model border) is returned to be merged back.
+    Returns (inputs, chroma): inputs are scaled floats, or uint8 frames when tiling.
+    Native input models get the decoded frames as they are and post-upsampling
+    models get them without the bicubic upscale."""
+    if is_native_model(model):
+        if tile_size:
+            raise ValueError('Tiled inference is not supported by native input models')
+        return np.array(imgs_lr), None
+    post = is_post_upsampling(model)
+    upscale = lambda img: cv2.resize(img,(img.shape[1]*scale,img.shape[0]*scale), interpolation = cv2.INTER_CUBIC)
+    imgs_hr = np.array(imgs_lr) if post else np.array([upscale(img_lr) for img_lr in imgs_lr])
+    chroma = None
+    if is_luma_model(model):
+        border = model_border(model)
+        imgs_hr = np.array([cv2.cvtColor(img_hr, cv2.COLOR_RGB2YCrCb) for img_hr in imgs_hr])
+        if post:
+            chroma = np.array([upscale(img[..., 1:]) for img in imgs_hr])
+        else:
+            chroma = imgs_hr[:, border:imgs_hr.shape[1]-border, border:imgs_hr.shape[2]-border, 1:]
+        imgs_hr = imgs_hr[..., :1]
+    if tile_size:
+        return imgs_hr, chroma
+    return scale_lr_imgs(imgs_hr), chroma
+
+def run_batch(model,inputs,chroma=None,tile_size=None,scale=None):
+    """Predict the uint8 RGB sr frames of the inputs made by prepare_batch"""
+    if is_native_model(model):
+        return model.predict(inputs, batch_size=len(inputs))
+    if tile_size and is_post_upsampling(model):
+        imgs_sr = np.array([predict_tiled_post(model,img_lr,tile_size,scale) for img_lr in inputs])
+    elif tile_size:
+        imgs_sr = np.array([predict_tiled(model,img_hr,tile_size) for img_hr in inputs])
+    else:
+        imgs_sr = unscale_hr_imgs(model.predict(inputs, batch_size=len(inputs)))
+    if chroma is not None:
+        imgs_sr = np.array([cv2.cvtColor(np.concatenate([img_sr, img_chroma], axis=-1), cv2.COLOR_YCrCb2RGB)
+                            for img_sr, img_chroma in zip(imgs_sr, chroma)])
+    return imgs_sr
+
+def sr_batch_genarator(model,imgs_lr,scale,tile_size=None):
+    """Predict sr frames given a list of LR frames of the same shape in one forward pass"""
+    inputs, chroma = prepare_batch(model,imgs_lr,scale,tile_size=tile_size)
+    return run_batch(model,inputs,chroma,tile_size=tile_size,scale=scale)
+
+def open_srvideo(lr_videopath,sr_videopath,crf=15,fps=None,gpu=False):
+    """Open the LR video reader and the SR video writer"""
+    import skvideo.io
     videogen = skvideo.io.FFmpegReader(lr_videopath)
-    t_frames, height, width, _  = videogen.getShape() 
     print(">> Inputshape: ",videogen.getShape())
     metadata = skvideo.io.ffprobe(lr_videopath)
     #print(json.dumps(metadata["video"], indent=4))
@@ -79,36 +205,206 @@ def write_srvideo(model=None,lr_videopath=None,sr_videopath=None,scale=None,prin
     codec = 'h264_nvenc' if (gpu == 'True') else 'libx264' 
     writer = skvideo.io.FFmpegWriter(sr_videopath, 
     outputdict={'-vcodec': codec, '-r': _fps, '-crf': str(crf), '-pix_fmt': 'yuv420p'})
+    return videogen, writer
+    
+def write_srvideo(model=None,lr_videopath=None,sr_videopath=None,scale=None,print_frequency=False,crf=15,fps=None,gpu=False,batch_size=1,pipeline=False,queue_size=4,tile_size=None):
+    """Generate SR video given LR video 
+        batch_size: number of frames predicted in each forward pass
+        pipeline: run decode, upscale, inference and encode as concurrent stages
+        queue_size: batches buffered between two pipeline stages
+        tile_size: size of the output tiles predicted one at a time, None for full frames
+    """
+    if pipeline:
+        return write_srvideo_pipeline(model,lr_videopath,sr_videopath,scale,print_frequency=print_frequency,
+            crf=crf,fps=fps,gpu=gpu,batch_size=batch_size,queue_size=queue_size,tile_size=tile_size)
+    import skvideo.io
+    from tqdm import tqdm
+    videogen, writer = open_srvideo(lr_videopath,sr_videopath,crf=crf,fps=fps,gpu=gpu)
+    t_frames = videogen.getShape()[0]
     count = 0
     time_elapsed = []
+    batch_elapsed = []
+    batch = []
     print(">> Writing video...")
-    for frame in tqdm(videogen):
+    def write_batch():
         start = timer()
-        img_sr = sr_genarator(model,frame,scale=scale)
-        writer.writeFrame(img_sr)
+        imgs_sr = sr_batch_genarator(model,batch,scale=scale,tile_size=tile_size)
+        for img_sr in imgs_sr:
+            writer.writeFrame(img_sr)
         end = timer()
-        time_elapsed.append(end - start)
+        batch_elapsed.append(end - start)
+        # Per frame time, so the result is comparable across batch sizes
+        time_elapsed.extend([(end - start)/len(batch)] * len(batch))
+        del batch[:]
+    start_video = timer()
+    for frame in tqdm(videogen):
+        batch.append(frame)
         count +=1
+        if len(batch) == batch_size:
+            write_batch()
         if (print_frequency): 
-            if(count % print_frequency == 0):
+            if(count % print_frequency == 0 and len(time_elapsed)):
                 print('... Time per Frame: '+str(np.mean(time_elapsed))+'s')
+                print('... Time per Batch: '+str(np.mean(batch_elapsed))+'s')
                 print('... Estimated time: '+str(np.mean(time_elapsed)*(t_frames-count)/60.)+'min')
+    if len(batch):
+        write_batch()
+    end_video = timer()
     writer.close()
     videogen = skvideo.io.FFmpegReader(sr_videopath)
     print(">> Outputshape: ",videogen.getShape())
+    print('>> Batch size {}: {:.4f}s per batch, {:.2f} fps overall'.format(
+        batch_size, np.mean(batch_elapsed), count / (end_video - start_video)))
     print('>> Video resized in '+str(np.sum(time_elapsed))+'s')
     return time_elapsed
 
 
-def write_sr_images(model=None, lr_imagepath=None, sr_imagepath=None,scale=None):
+def write_srvideo_pipeline(model=None,lr_videopath=None,sr_videopath=None,scale=None,print_frequency=False,crf=15,fps=None,gpu=False,batch_size=1,queue_size=4,tile_size=None):
+    """Generate SR video given LR video with decode, upscale, inference and encode
+    running concurrently. Stages are connected by bounded queues, so a slow stage
+    blocks the ones before it, and each stage handles batches in order.
+    Inference runs on the calling thread, where the Keras graph lives."""
+    import skvideo.io
+    from tqdm import tqdm
+    videogen, writer = open_srvideo(lr_videopath,sr_videopath,crf=crf,fps=fps,gpu=gpu)
+    t_frames = videogen.getShape()[0]
+    q_decoded = queue.Queue(maxsize=queue_size)
+    q_upscaled = queue.Queue(maxsize=queue_size)
+    q_predicted = queue.Queue(maxsize=queue_size)
+    stage_time = {'decode': 0., 'upscale': 0., 'inference': 0., 'encode': 0.}
+    stop = threading.Event()
+    errors = []
+    END = None
+
+    def put(q, item):
+        # Block while the next stage is busy, give up if the pipeline stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END
+
+    def decode():
+        try:
+            batch = []
+            start = timer()
+            for frame in videogen:
+                batch.append(frame)
+                if len(batch) == batch_size:
+                    stage_time['decode'] += timer() - start
+                    if not put(q_decoded, batch):
+                        return
+                    batch = []
+                    start = timer()
+            stage_time['decode'] += timer() - start
+            if len(batch):
+                put(q_decoded, batch)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(q_decoded, END)
+
+    def upscale():
+        try:
+            while True:
+                batch = get(q_decoded)
+                if batch is END:
+                    break
+                start = timer()
+                prepared = prepare_batch(model,batch,scale,tile_size=tile_size)
+                stage_time['upscale'] += timer() - start
+                if not put(q_upscaled, prepared):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(q_upscaled, END)
+
+    def encode():
+        try:
+            while True:
+                imgs_sr = get(q_predicted)
+                if imgs_sr is END:
+                    break
+                start = timer()
+                for img_sr in imgs_sr:
+                    writer.writeFrame(img_sr)
+                stage_time['encode'] += timer() - start
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=target) for target in (decode, upscale, encode)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    print(">> Writing video (pipeline)...")
+    count = 0
+    time_elapsed = []
+    start_video = timer()
+    pbar = tqdm(total=t_frames)
+    try:
+        while True:
+            prepared = get(q_upscaled)
+            if prepared is END:
+                break
+            start = timer()
+            imgs_sr = run_batch(model,prepared[0],prepared[1],tile_size=tile_size,scale=scale)
+            end = timer()
+            stage_time['inference'] += end - start
+            time_elapsed.extend([(end - start)/len(imgs_sr)] * len(imgs_sr))
+            if not put(q_predicted, imgs_sr):
+                break
+            count += len(imgs_sr)
+            pbar.update(len(imgs_sr))
+            if (print_frequency):
+                if(count // print_frequency != (count - len(imgs_sr)) // print_frequency):
+                    print('... Stage time per frame: '+', '.join(
+                        '{} {:.4f}s'.format(k, v/count) for k, v in stage_time.items()))
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        put(q_predicted, END)
+        for thread in threads:
+            thread.join()
+        pbar.close()
+        writer.close()
+    if errors:
+        raise errors[0]
+    end_video = timer()
+
+    videogen = skvideo.io.FFmpegReader(sr_videopath)
+    print(">> Outputshape: ",videogen.getShape())
+    for k, v in stage_time.items():
+        print('>> Stage {}: {:.2f}s busy, {:.4f}s per frame'.format(k, v, v/max(count,1)))
+    print('>> Bottleneck stage: {}'.format(max(stage_time, key=stage_time.get)))
+    print('>> Video resized in {:.2f}s, {:.2f} fps overall'.format(end_video - start_video, count/(end_video - start_video)))
+    return time_elapsed
+
+
+def write_sr_images(model=None, lr_imagepath=None, sr_imagepath=None,scale=None,tile_size=None):
     print(">> Writing image...")
     time_elapsed = []
     # Load the images to perform test on images
-    img_lr = DataLoader.load_img(lr_imagepath,colorspace='RGB')
+    img_lr = np.array(Image.open(lr_imagepath).convert('RGB'))
         
     # Create super resolution images
     start = timer()
-    img_sr = sr_genarator(model,img_lr,scale)    
+    img_sr = sr_genarator(model,img_lr,scale,tile_size=tile_size)    
     end = timer()
     time_elapsed.append(end - start)   
 
@@ -0,0 +1,214 @@
+import json
+import threading
+import numpy as np
+import cv2
+from collections import deque
+from timeit import default_timer as timer
+from urllib.parse import urlparse, parse_qs
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import restore
+
+
+class PredictorClosed(RuntimeError):
+    pass
+
+
+class SRRequest():
+    def __init__(self, img, scale):
+        self.img = img
+        self.scale = scale
+        self.arrival = timer()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingPredictor():
+    """Groups concurrent requests with the same scale and image shape into one
+    forward pass. A batch runs when it reaches max_batch requests or when its
+    oldest request has waited max_latency seconds.
+    """
+    def __init__(self, models, graph=None, max_batch=8, max_latency=0.01, tile_size=None):
+        """
+        :param dict models: keras model of each upscaling factor
+        :param graph: tensorflow graph of the models, needed to predict from the batching thread
+        :param int max_batch: most requests per forward pass
+        :param float max_latency: seconds a request may wait for others to join its batch
+        :param int tile_size: tile size of the inference, None for full images
+        """
+        self.models = models
+        self.graph = graph
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.tile_size = tile_size
+        self.buckets = {}
+        self.condition = threading.Condition()
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.served = 0
+        self.failed = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def predict(self, img, scale):
+        """Super-resolve an uint8 RGB image, blocking until its batch ran"""
+        if scale not in self.models:
+            raise ValueError('No model for scale {}, available: {}'.format(scale, sorted(self.models)))
+        request = SRRequest(img, scale)
+        with self.condition:
+            if not self.running:
+                raise PredictorClosed('The predictor is shutting down')
+            self.buckets.setdefault((scale, img.shape), []).append(request)
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def next_batch(self):
+        """Wait for the bucket with the oldest request to fill up or reach its deadline"""
+        with self.condition:
+            while self.running and not self.buckets:
+                self.condition.wait()
+            if not self.running:
+                return []
+            key = min(self.buckets, key=lambda key: self.buckets[key][0].arrival)
+            deadline = self.buckets[key][0].arrival + self.max_latency
+            while self.running and len(self.buckets[key]) < self.max_batch and timer() < deadline:
+                self.condition.wait(deadline - timer())
+            batch = self.buckets[key][:self.max_batch]
+            del self.buckets[key][:self.max_batch]
+            if not self.buckets[key]:
+                del self.buckets[key]
+            return batch
+
+    def run(self):
+        while self.running:
+            batch = self.next_batch()
+            if not batch:
+                continue
+            try:
+                model = self.models[batch[0].scale]
+                imgs_lr = [request.img for request in batch]
+                if self.graph is not None:
+                    with self.graph.as_default():
+                        imgs_sr = restore.sr_batch_genarator(model, imgs_lr, batch[0].scale, tile_size=self.tile_size)
+                else:
+                    imgs_sr = restore.sr_batch_genarator(model, imgs_lr, batch[0].scale, tile_size=self.tile_size)
+                for request, img_sr in zip(batch, imgs_sr):
+                    request.result = img_sr
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            end = timer()
+            with self.condition:
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    self.latencies.append(end - request.arrival)
+                    if request.error is None:
+                        self.served += 1
+                    else:
+                        self.failed += 1
+            for request in batch:
+                request.done.set()
+        self.fail_pending()
+
+    def fail_pending(self):
+        """Release the requests still queued at shutdown with a PredictorClosed error"""
+        with self.condition:
+            pending = [request for bucket in self.buckets.values() for request in bucket]
+            self.buckets = {}
+            self.failed += len(pending)
+        for request in pending:
+            request.error = PredictorClosed('The predictor is shutting down')
+            request.done.set()
+
+    def stats(self):
+        with self.condition:
+            latencies = np.array(self.latencies) * 1000.
+            stats = {
+                'queue_depth': sum(len(bucket) for bucket in self.buckets.values()),
+                'buckets': len(self.buckets),
+                'served': self.served,
+                'failed': self.failed,
+                'batches': len(self.batch_sizes),
+                'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.,
+            }
+        for p in [50, 90, 99]:
+            stats['latency_p{}_ms'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) else 0.
+        return stats
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class SRRequestHandler(BaseHTTPRequestHandler):
+    """POST /sr?scale=N with an encoded image returns the PNG super-resolved image,
+    GET /stats returns the queue depth, batch and latency statistics as JSON"""
+
+    def send_body(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, data):
+        self.send_body(code, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self.send_json(200, self.server.predictor.stats())
+        elif path == '/health':
+            self.send_json(200, {'scales': sorted(self.server.predictor.models)})
+        else:
+            self.send_json(404, {'error': 'Unknown path {}'.format(path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/sr':
+            self.send_json(404, {'error': 'Unknown path {}'.format(url.path)})
+            return
+        try:
+            scale = int(parse_qs(url.query).get('scale', [self.server.default_scale])[0])
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('Could not decode the image')
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            img_sr = self.server.predictor.predict(img, scale)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except PredictorClosed as e:
+            self.send_json(503, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        _, png = cv2.imencode('.png', cv2.cvtColor(img_sr, cv2.COLOR_RGB2BGR))
+        self.send_body(200, png.tobytes(), 'image/png')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SRServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, predictor, default_scale=None):
+        HTTPServer.__init__(self, address, SRRequestHandler)
+        self.predictor = predictor
+        self.default_scale = default_scale if default_scale is not None else min(predictor.models)
@@ -1,37 +1,38 @@
 import os
+import queue
 import logging
 import fnmatch
+import multiprocessing
+from timeit import default_timer as timer
 import tensorflow as tf
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 from keras.layers import Input, Conv2D, MaxPooling2D
-from keras.layers import ReLU
-from keras.optimizers import SGD, Adam
+from keras.layers import ReLU, Lambda
+from keras import backend as K
 from keras.models import Model
-from keras.callbacks import TensorBoard, ModelCheckpoint, LambdaCallback
-from keras.callbacks import ReduceLROnPlateau, EarlyStopping
 from keras.initializers import RandomNormal
 
 
 import restore 
-from util import DataLoader, plot_test_images
-from losses import psnr3 as psnr
-from losses import euclidean, cosine, charbonnier
 
 class SRCNN():
     """
         height_lr: height of the lr image
         width_lr: width of the lr image 
-        channels: number of channel of the image
+        channels: number of channel of the image, 1 to super-resolve only Y (colorspace 'YCbCr')
         upscaling_factor= factor upscaling
         lr = learning rate
         training_mode: True or False
         colorspace: 'RGB' or 'YCbCr'
+        architecture: 'srcnn' runs the network on the bicubic upscaled image,
+            'espcn' runs it in LR space and upsamples with a sub-pixel convolution
     """
     def __init__(self,
                  height_lr=16, width_lr=16, channels=3,
                  upscaling_factor=4, lr = 1e-4,
                  training_mode=True,
-                 colorspace = 'RGB'
+                 colorspace = 'RGB',
+                 architecture = 'srcnn'
                  ):
 
         # Low-resolution image dimensions
@@ -47,6 +48,10 @@ class SRCNN():
         self.width_hr = int(self.width_lr * self.upscaling_factor)
 
         # Low-resolution and high-resolution shapes
+        if channels not in [1, 3]:
+            raise ValueError('Channels must be either 1 or 3. You chose {}'.format(channels))
+        if channels == 1 and colorspace != 'YCbCr':
+            raise ValueError('Luma-only models (channels=1) must use the YCbCr colorspace. You chose {}'.format(colorspace))
         self.channels = channels
         self.colorspace = colorspace
 
@@ -56,8 +61,18 @@ class SRCNN():
         self.loss = "mse"
         self.lr = lr
 
+        if architecture not in ['srcnn', 'espcn']:
+            raise ValueError('Architecture must be either srcnn or espcn. You chose {}'.format(architecture))
+        self.architecture = architecture
+        # ESPCN takes LR inputs as they are
+        self.pre_upscale = architecture == 'srcnn'
+
         self.model = self.build_model()
-        self.compile_model(self.model)
+        # Inference only models are not compiled, skipping the optimizer and losses imports
+        if training_mode:
+            self.compile_model(self.model)
+        self.border = restore.model_border(self.model)
+        self.inference_model = None
 
 
     def save_weights(self, filepath):
@@ -74,7 +89,8 @@ class SRCNN():
     
     def compile_model(self, model):
         """Compile the srcnn with appropriate optimizer"""
-        
+        from keras.optimizers import SGD
+        from losses import psnr3 as psnr
         model.compile(
             loss=self.loss,
             optimizer= SGD(lr=self.lr, momentum=0.9, decay=1e-6, nesterov=True), #Adam(lr=self.lr,beta_1=0.9, beta_2=0.999), 
@@ -82,6 +98,11 @@ class SRCNN():
         )
 
     def build_model(self):
+        if self.architecture == 'espcn':
+            return self.build_espcn_model()
+        return self.build_srcnn_model()
+
+    def build_srcnn_model(self):
 
         inputs = Input(shape=(None, None, self.channels))
           
@@ -103,6 +124,91 @@ class SRCNN():
         #model.summary()
         return model
 
+    def build_espcn_model(self):
+        """ESPCN-style post-upsampling: features are computed at LR resolution with
+        same padding and a sub-pixel convolution (depth_to_space) upsamples at the end"""
+        scale = self.upscaling_factor
+        inputs = Input(shape=(None, None, self.channels))
+
+        x = Conv2D(filters= 64, kernel_size = (5,5), strides=1, 
+            kernel_initializer=RandomNormal(mean=0.0, stddev=0.001, seed=None),bias_initializer='zeros',
+            padding = "same", use_bias=True, name='conv1')(inputs)
+        x = ReLU()(x)
+
+        x = Conv2D(filters= 32, kernel_size = (3,3), strides=1, 
+            kernel_initializer=RandomNormal(mean=0.0, stddev=0.001, seed=None),bias_initializer='zeros',
+            padding = "same", use_bias=True, name='conv2')(x)
+        x = ReLU()(x)
+
+        x = Conv2D(filters= self.channels * scale * scale, kernel_size = (3,3), strides=1, 
+            kernel_initializer=RandomNormal(mean=0.0, stddev=0.001, seed=None),bias_initializer='zeros',
+            padding = "same", use_bias=True, name='conv3')(x)
+        x = Lambda(lambda x: tf.depth_to_space(x, scale), name='subpixel')(x)
+
+        model = Model(inputs=inputs, outputs=x)
+        # Tells restore to feed LR frames without bicubic pre-upscaling
+        model.upsampling = 'post'
+        return model
+
+    def build_inference_model(self):
+        """Inference graph taking native resolution uint8 RGB LR frames and returning uint8 SR frames.
+        Bicubic upscale, normalization, luma/chroma split for 1 channel models and the
+        clip/cast back to uint8 all run inside the graph, sharing the weights of self.model.
+        Note that TF bicubic resize is not bit-exact with the cv2 resize used in training.
+        Post-upsampling models get the LR frames, only their chroma is upscaled."""
+        scale = self.upscaling_factor
+        border = self.border
+
+        def bicubic(x):
+            size = tf.shape(x)[1:3] * scale
+            try:
+                x = tf.image.resize_bicubic(x, size, half_pixel_centers=True)
+            except TypeError:
+                # if you have older version of tensorflow
+                x = tf.image.resize_bicubic(x, size)
+            return tf.clip_by_value(x, 0., 255.)
+
+        def upscale(x):
+            x = K.cast(x, 'float32')
+            return bicubic(x) if self.pre_upscale else x
+
+        def rgb_to_ycrcb(x):
+            r, g, b = x[..., 0:1], x[..., 1:2], x[..., 2:3]
+            y = 0.299 * r + 0.587 * g + 0.114 * b
+            return K.concatenate([y, (r - y) * 0.713 + 128., (b - y) * 0.564 + 128.])
+
+        def ycrcb_to_rgb(x):
+            y, cr, cb = x[..., 0:1], x[..., 1:2] - 128., x[..., 2:3] - 128.
+            return K.concatenate([y + 1.403 * cr, y - 0.714 * cr - 0.344 * cb, y + 1.773 * cb])
+
+        def crop(x):
+            return x[:, border:-border, border:-border, :] if border else x
+
+        def to_uint8(x):
+            return K.cast(tf.clip_by_value(x, 0., 255.), 'uint8')
+
+        inputs = Input(shape=(None, None, 3), dtype='uint8')
+        x = Lambda(upscale)(inputs)
+        if self.channels == 1:
+            x = Lambda(rgb_to_ycrcb)(x)
+            y = self.model(Lambda(lambda x: x[..., :1] / 255.)(x))
+            chroma = Lambda(lambda x: crop(x)[..., 1:] if self.pre_upscale else bicubic(x[..., 1:]))(x)
+            x = Lambda(lambda t: ycrcb_to_rgb(K.concatenate([t[0] * 255., t[1]])))([y, chroma])
+        else:
+            x = self.model(Lambda(lambda x: x / 255.)(x))
+            x = Lambda(lambda x: x * 255.)(x)
+        x = Lambda(to_uint8)(x)
+
+        model = Model(inputs=inputs, outputs=x)
+        # Tells restore to feed decoded frames as they are
+        model.native_input = True
+        return model
+
+    def get_inference_model(self):
+        if self.inference_model is None:
+            self.inference_model = self.build_inference_model()
+        return self.inference_model
+
     def train(self,
             epochs=50,
             batch_size=8,
@@ -113,6 +219,16 @@ class SRCNN():
             log_tensorboard_update_freq=10,
             workers=4,
             max_queue_size=5,
+            cache_size=0,
+            patch_store=None,
+            video_decoders=0,
+            frames_per_seek=1,
+            batch_dtype='float32',
+            loader='sequence',
+            parallel_calls=None,
+            profile_loader=False,
+            async_test=True,
+            degradation='cv2',
             model_name='SRCNN',
             media_type='i', 
             datapath_train='../../../videos_harmonic/MYANMAR_2160p/train/',
@@ -122,42 +238,106 @@ class SRCNN():
             log_tensorboard_path='../logs/',
             log_test_path='../test/'
         ):
+        # Training only dependencies
+        from keras.callbacks import TensorBoard, ModelCheckpoint, LambdaCallback
+        from keras.callbacks import ReduceLROnPlateau, EarlyStopping
+        from util import DataLoader, ImageCache, LoaderProfile, TestSet, plot_test_images
+        from patches import PatchDataset
+        from tfdata import TFDataLoader
+
+        # Shared cache of decoded training images (cache_size in MB)
+        cache = None
+        if cache_size and media_type == 'i':
+            cache = ImageCache(cache_size * 1024 * 1024)
+            print(">> Caching decoded images up to {}MB in {}".format(cache_size, cache.cache_dir))
 
         # Create data loaders
+        profile = None
         
-        train_loader = DataLoader(
-            datapath_train, batch_size,
-            self.height_hr, self.width_hr,
-            self.upscaling_factor,
-            crops_per_image,
-            media_type,
-            self.channels,
-            self.colorspace
-        )
+        if loader == 'tfdata' and media_type == 'i' and patch_store is None:
+            train_loader = TFDataLoader(
+                datapath_train, batch_size,
+                self.height_hr, self.width_hr,
+                self.upscaling_factor,
+                crops_per_image,
+                self.channels,
+                self.colorspace,
+                num_parallel_calls=parallel_calls,
+                prefetch=max_queue_size,
+                border=self.border,
+                pre_upscale=self.pre_upscale
+            )
+        elif patch_store is not None:
+            train_loader = PatchDataset(patch_store, batch_size, self.channels, self.border, self.pre_upscale)
+            if (train_loader.scale, train_loader.height_hr, train_loader.width_hr, train_loader.colorspace) != \
+                    (self.upscaling_factor, self.height_hr, self.width_hr, self.colorspace):
+                raise ValueError(
+                    'Patch store {} does not match the model scale, crop size or colorspace'.format(patch_store))
+        else:
+            # Stage times of the training DataLoader summed over its workers
+            profile = LoaderProfile() if profile_loader else None
+            train_loader = DataLoader(
+                datapath_train, batch_size,
+                self.height_hr, self.width_hr,
+                self.upscaling_factor,
+                crops_per_image,
+                media_type,
+                self.channels,
+                self.colorspace,
+                cache,
+                video_decoders,
+                frames_per_seek,
+                batch_dtype,
+                self.border,
+                self.pre_upscale,
+                profile,
+                degradation
+            )
         
 
         validation_loader = None 
-        if datapath_validation is not None:
-            validation_loader = DataLoader(
+        if datapath_validation is not None and isinstance(train_loader, TFDataLoader):
+            validation_loader = TFDataLoader(
                 datapath_validation, batch_size,
                 self.height_hr, self.width_hr,
                 self.upscaling_factor,
                 crops_per_image,
-                media_type,
                 self.channels,
-                self.colorspace
-        )
-
-        test_loader = None
-        if datapath_test is not None:
-            test_loader = DataLoader(
-                datapath_test, 1,
+                self.colorspace,
+                num_parallel_calls=parallel_calls,
+                prefetch=max_queue_size,
+                border=self.border,
+                pre_upscale=self.pre_upscale
+            )
+        elif datapath_validation is not None:
+            validation_loader = DataLoader(
+                datapath_validation, batch_size,
                 self.height_hr, self.width_hr,
                 self.upscaling_factor,
-                1,
+                crops_per_image,
                 media_type,
                 self.channels,
-                self.colorspace
+                self.colorspace,
+                cache,
+                video_decoders,
+                frames_per_seek,
+                batch_dtype,
+                self.border,
+                self.pre_upscale,
+                degradation=degradation
+        )
+
+        test_loader_args = dict(
+            datapath=datapath_test, batch_size=1,
+            height_hr=self.height_hr, width_hr=self.width_hr,
+            scale=self.upscaling_factor,
+            crops_per_image=1,
+            media_type=media_type,
+            channels=self.channels,
+            colorspace=self.colorspace,
+            border=self.border,
+            pre_upscale=self.pre_upscale,
+            degradation=degradation
         )
 
         # Callback: tensorboard
@@ -196,32 +376,70 @@ class SRCNN():
         callbacks.append(modelcheckpoint)
   
         # Callback: test images plotting
+        test_plotter = None
         if datapath_test is not None:
-            testplotting = LambdaCallback(
-                on_epoch_end=lambda epoch, logs: None if ((epoch+1) % print_frequency != 0 ) else plot_test_images(
-                    self.model,
-                    test_loader,
-                    datapath_test,
-                    log_test_path,
-                    epoch+1,
-                    name=model_name,
-                    channels=self.channels,
-                    colorspace=self.colorspace))
-        callbacks.append(testplotting)
+            plot_args = dict(datapath_test=datapath_test, test_output=log_test_path, name=model_name,
+                             channels=self.channels, colorspace=self.colorspace)
+            if async_test:
+                # Predictions and figures run in a background process on a copy of the weights
+                model_args = dict(height_lr=self.height_lr, width_lr=self.width_lr, channels=self.channels,
+                                  upscaling_factor=self.upscaling_factor, colorspace=self.colorspace,
+                                  architecture=self.architecture)
+                test_plotter = TestPlotter(model_args, test_loader_args, plot_args,
+                    os.path.join(log_tensorboard_path, model_name) if log_tensorboard_path else None)
+                testplotting = LambdaCallback(
+                    on_epoch_end=lambda epoch, logs: None if ((epoch+1) % print_frequency != 0 ) else test_plotter.submit(
+                        self.model, epoch+1))
+            else:
+                test_loader = DataLoader(**test_loader_args)
+                test_set = TestSet(test_loader, datapath_test, self.channels, self.colorspace)
+                testplotting = LambdaCallback(
+                    on_epoch_end=lambda epoch, logs: None if ((epoch+1) % print_frequency != 0 ) else plot_test_images(
+                        self.model,
+                        test_loader,
+                        epoch=epoch+1,
+                        test_set=test_set,
+                        **plot_args))
+            callbacks.append(testplotting)
+
+        # Callback: loader profile
+        if profile is not None:
+            def write_profile(epoch, logs):
+                print(">> Loader profile: {}".format(profile.stats()))
+                if log_tensorboard_path:
+                    profile.write_summary(tensorboard.writer, epoch)
+            callbacks.append(LambdaCallback(on_epoch_end=write_profile))
 
         #callbacks.append(TQDMCallback())
 
-        self.model.fit_generator(
-            train_loader,
-            steps_per_epoch=steps_per_epoch,
-            epochs=epochs,
-            validation_data=validation_loader,
-            validation_steps=steps_per_validation,
-            callbacks=callbacks,
-            shuffle=True,
-            use_multiprocessing=workers>1,
-            workers=workers
-        )
+        # tf.data loaders parallelize inside TensorFlow, one feeding thread is enough.
+        # The tf degradation can not run in processes forked from this one, which already
+        # runs TensorFlow, so its workers are threads sharing one resize session
+        use_multiprocessing = workers > 1 and not isinstance(train_loader, TFDataLoader)
+        if use_multiprocessing and degradation == 'tf':
+            print(">> Loading batches with {} threads, the tf degradation can not run in forked workers".format(workers))
+            use_multiprocessing = False
+
+        try:
+            self.model.fit_generator(
+                train_loader,
+                steps_per_epoch=steps_per_epoch,
+                epochs=epochs,
+                validation_data=validation_loader,
+                validation_steps=steps_per_validation,
+                callbacks=callbacks,
+                shuffle=True,
+                use_multiprocessing=use_multiprocessing,
+                workers=1 if isinstance(train_loader, TFDataLoader) else workers
+            )
+        finally:
+            if cache is not None:
+                print(">> Image cache: {}".format(cache.stats()))
+                cache.close()
+            if profile is not None:
+                profile.close()
+            if test_plotter is not None:
+                test_plotter.close()
 
 
     def predict(self,
@@ -231,7 +449,11 @@ class SRCNN():
             qp = 8,
             fps = None,
             media_type = None,
-            gpu = False
+            gpu = False,
+            batch_size = 1,
+            pipeline = False,
+            tile_size = None,
+            native_input = False
         ):
         """ lr_videopath: path of video in low resoluiton
             sr_videopath: path to output video 
@@ -239,11 +461,16 @@ class SRCNN():
             crf: [0,51] QP parameter 0 is the best quality and 51 is the worst one
             fps: framerate if None is use the same framerate of the LR video
             media_type: type of media 'v' to video and 'i' to image
+            batch_size: number of video frames predicted in each forward pass
+            pipeline: decode, upscale, predict and encode video frames in concurrent stages
+            tile_size: predict output tiles of tile_size x tile_size to bound memory, None for full frames
+            native_input: feed uint8 LR frames to the in-graph upscale model of build_inference_model
         """
+        model = self.get_inference_model() if native_input else self.model
         if(media_type == 'v'):
-            time_elapsed = restore.write_srvideo(self.model,lr_path,sr_path,self.upscaling_factor,print_frequency=print_frequency,crf=qp,fps=fps,gpu=gpu)
+            time_elapsed = restore.write_srvideo(model,lr_path,sr_path,self.upscaling_factor,print_frequency=print_frequency,crf=qp,fps=fps,gpu=gpu,batch_size=batch_size,pipeline=pipeline,tile_size=tile_size)
         elif(media_type == 'i'):
-            time_elapsed = restore.write_sr_images(self.model, lr_imagepath=lr_path, sr_imagepath=sr_path,scale=self.upscaling_factor)
+            time_elapsed = restore.write_sr_images(model, lr_imagepath=lr_path, sr_imagepath=sr_path,scale=self.upscaling_factor,tile_size=tile_size)
         else:
             print(">> Media type not defined or not suported!")
             return 0
@@ -266,7 +493,7 @@ def restoration(resolution=None,k=1,qp='25'):
         outpath ='/media/joao/SAMSUNG2/data/out/SRCNN/'
         lfilenames = []
         for dirpath, _, filenames in os.walk(datapath):
-            lfilenames = [os.path.join(dirpath, f) for f in filenames if any(filetype in f.lower() for filetype in ['jpeg', 'png', 'jpg','mp4','264','webm','wma'])]
+            lfilenames = [os.path.join(dirpath, f) for f in filenames if any(filetype in f.lower() for filetype in ['jpeg', 'png', 'jpg','mp4','264','webm','wma']) and not f.endswith('.index.json')]
         i=1
         for filename in sorted(lfilenames):
             if(i>=k):
@@ -326,6 +553,197 @@ def restoration(resolution=None,k=1,qp='25'):
     
     
 
+# State of each batch_restoration worker process
+_worker_srcnn = None
+_worker_error = None
+
+class FrozenSRCNN():
+    """SRCNN.predict on a frozen graph from export.py or an int8 model from quantize.py,
+    no keras model is built"""
+    def __init__(self, path, threads=None):
+        if path.endswith('.tflite'):
+            self.model = restore.load_quantized_model(path, threads=threads)
+        else:
+            self.model = restore.load_frozen_model(path, threads=threads)
+        self.upscaling_factor = self.model.scale
+
+    predict = SRCNN.predict
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+def _init_restoration_worker(model_args, weights, threads):
+    """Limit the worker threads and build the network once per worker.
+    A worker dying here would be replaced by the pool forever, so the error is
+    kept and raised by its first task instead"""
+    global _worker_srcnn, _worker_error
+    try:
+        if threads:
+            import cv2
+            cv2.setNumThreads(threads)
+        if weights.endswith(('.pb', '.tflite')):
+            _worker_srcnn = FrozenSRCNN(weights, threads=threads)
+            return
+        if threads:
+            config = tf.ConfigProto(
+                intra_op_parallelism_threads=threads,
+                inter_op_parallelism_threads=1)
+            K.set_session(tf.Session(config=config))
+        _worker_srcnn = SRCNN(**model_args)
+        _worker_srcnn.load_weights(weights=weights)
+    except Exception as e:
+        _worker_error = 'Could not load {}: {}: {}'.format(weights, type(e).__name__, e)
+
+def _restore_env(saved_env):
+    """Put back the environment variables saved before starting a worker pool"""
+    for var, value in saved_env.items():
+        if value is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = value
+
+def _restore_file(task):
+    """Restore one file in a worker, returning its summary"""
+    lr_path, sr_path, predict_args = task
+    if _worker_error is not None:
+        raise RuntimeError(_worker_error)
+    summary = {'file': lr_path, 'output': sr_path, 'pid': os.getpid(),
+               'frames': 0, 'seconds': 0., 'fps': 0., 'error': None}
+    start = timer()
+    try:
+        time_elapsed = _worker_srcnn.predict(lr_path=lr_path, sr_path=sr_path, **predict_args)
+        summary['frames'] = len(time_elapsed)
+    except Exception as e:
+        summary['error'] = str(e)
+    summary['seconds'] = timer() - start
+    if summary['frames']:
+        summary['fps'] = summary['frames'] / summary['seconds']
+    return summary
+
+def batch_restoration(lr_paths, outpath, weights, model_args=None, processes=2, threads=None, media_type='v', **predict_args):
+    """Restore many files spread over a pool of worker processes.
+        lr_paths: files to restore, outputs are written to outpath with the same name (.mp4 for videos)
+        weights: path of the .h5 weights or of a frozen .pb graph, loaded once by each worker
+        model_args: SRCNN constructor arguments, e.g. upscaling_factor and channels
+        processes: number of worker processes
+        threads: threads per worker for TensorFlow, OpenMP and OpenCV, None to leave the defaults
+        predict_args: extra SRCNN.predict arguments (qp, batch_size, tile_size...)
+    Returns the per-file summaries with frames, seconds and fps.
+    """
+    if not os.path.isfile(weights):
+        raise IOError('Weights {} not found'.format(weights))
+    if not os.path.isdir(outpath):
+        os.makedirs(outpath)
+    predict_args['media_type'] = media_type
+    tasks = []
+    for lr_path in sorted(lr_paths):
+        name = os.path.basename(lr_path)
+        if media_type == 'v':
+            name = name.split('.')[0] + '.mp4'
+        tasks.append((lr_path, os.path.join(outpath, name), predict_args))
+
+    # The thread pools of OpenMP, MKL and OpenBLAS are sized when numpy is imported,
+    # before the initializer runs, so the spawned workers take the limits from their environment
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    if threads:
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(threads)
+
+    # Spawned workers do not inherit the TensorFlow state of this process
+    context = multiprocessing.get_context('spawn')
+    try:
+        pool = context.Pool(processes, initializer=_init_restoration_worker,
+                            initargs=(model_args or {}, weights, threads))
+    except Exception:
+        _restore_env(saved_env)
+        raise
+    start = timer()
+    summaries = []
+    try:
+        for summary in pool.imap_unordered(_restore_file, tasks):
+            summaries.append(summary)
+            if summary['error']:
+                print(">> Failed {}: {}".format(summary['file'], summary['error']))
+            else:
+                print(">> {} - {} frames in {:.2f}s ({:.2f} fps)".format(
+                    summary['file'], summary['frames'], summary['seconds'], summary['fps']))
+            logging.info('{file} {frames} frames {seconds:.2f}s {fps:.2f} fps error={error}'.format(**summary))
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+        _restore_env(saved_env)
+    elapsed = timer() - start
+    frames = sum(summary['frames'] for summary in summaries)
+    print(">> Restored {} files ({} failed), {} frames in {:.2f}s: {:.2f} fps overall".format(
+        len(summaries), len([summary for summary in summaries if summary['error']]),
+        frames, elapsed, frames / elapsed if elapsed else 0.))
+    return sorted(summaries, key=lambda summary: summary['file'])
+
+
+def _test_plotting_worker(model_args, loader_args, plot_args, log_dir, snapshots):
+    """Evaluate and plot the test images for each weight snapshot, on CPU so the
+    training process keeps its GPU memory"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from util import DataLoader, TestSet, plot_test_images
+    K.set_session(tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})))
+    K.set_learning_phase(0)
+    srcnn = SRCNN(training_mode=False, **model_args)
+    loader = DataLoader(**loader_args)
+    # Loaded and scored with bicubic once, each snapshot only runs the model
+    test_set = TestSet(loader, plot_args['datapath_test'], plot_args['channels'], plot_args['colorspace'])
+    writer = tf.summary.FileWriter(log_dir) if log_dir else None
+    while True:
+        snapshot = snapshots.get()
+        if snapshot is None:
+            break
+        weights, epoch = snapshot
+        srcnn.model.set_weights(weights)
+        scores = plot_test_images(srcnn.model, loader, epoch=epoch, test_set=test_set, **plot_args)
+        if writer is not None and scores:
+            writer.add_summary(tf.Summary(value=[
+                tf.Summary.Value(tag='test/' + key, simple_value=float(value)) for key, value in scores.items()]), epoch)
+            writer.flush()
+    if writer is not None:
+        writer.close()
+
+class TestPlotter():
+    """Runs plot_test_images in a background process on snapshots of the weights,
+    so training does not wait for the test predictions and figures.
+    Snapshots sent while the previous one is still waiting are skipped."""
+    def __init__(self, model_args, loader_args, plot_args, log_dir=None):
+        """
+        :param dict model_args: SRCNN constructor arguments of the trained model
+        :param dict loader_args: DataLoader arguments of the test loader
+        :param dict plot_args: plot_test_images arguments (datapath_test, test_output, name, channels, colorspace)
+        :param string log_dir: TensorBoard folder for the test PSNR, None to not log it
+        """
+        # Spawned so the worker does not share the TensorFlow state of training
+        context = multiprocessing.get_context('spawn')
+        self.snapshots = context.Queue(maxsize=1)
+        self.process = context.Process(target=_test_plotting_worker,
+            args=(model_args, loader_args, plot_args, log_dir, self.snapshots))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, model, epoch):
+        try:
+            self.snapshots.put_nowait((model.get_weights(), epoch))
+        except queue.Full:
+            print(">> Test plotting of epoch {} skipped, previous epoch still running".format(epoch))
+
+    def close(self, timeout=None):
+        """Finish the queued snapshot and stop the worker"""
+        while self.process.is_alive():
+            try:
+                self.snapshots.put(None, timeout=1)
+                break
+            except queue.Full:
+                pass
+        self.process.join(timeout)
+
 
 # Run the SRCNN network
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import os
+import cv2
+import tensorflow as tf
+from keras import backend as K
+from util import DataLoader
+
+
+def rgb_to_ycbcr(img):
+    """uint8 RGB to uint8 YCbCr with the JPEG full range matrix used by PIL's convert('YCbCr')"""
+    img = tf.cast(img, tf.float32)
+    matrix = tf.constant([[0.299, -0.168736, 0.5],
+                          [0.587, -0.331264, -0.418688],
+                          [0.114, 0.5, -0.081312]])
+    img = tf.tensordot(img, matrix, axes=1) + tf.constant([0., 128., 128.])
+    return tf.cast(tf.clip_by_value(tf.round(img), 0., 255.), tf.uint8)
+
+
+class TFDataLoader():
+    """tf.data alternative to the DataLoader Sequence for image training.
+    Decoding, random crops and the bicubic degradation run in parallel map calls
+    inside TensorFlow and batches are prefetched, so no worker processes are forked.
+    The degradation uses the same cv2 bicubic down/up resize as DataLoader.load_batch_image.
+    Iterating yields (lr, hr) float32 batches from the Keras session.
+    """
+    def __init__(self, datapath, batch_size, height_hr, width_hr,
+            scale, crops_per_image, channels=3, colorspace='RGB',
+            num_parallel_calls=None, prefetch=2, border=6, pre_upscale=True):
+        """
+        :param string datapath: filepath to training images
+        :param int num_parallel_calls: parallel decode/crop/degrade calls, None to let tf.data tune it
+        :param int prefetch: batches prepared ahead of the training step
+        :param int border: pixels per side trimmed from the HR targets
+        :param bool pre_upscale: upscale LR inputs back to HR size, False to keep them in LR size
+        """
+        self.datapath = datapath
+        self.batch_size = batch_size
+        self.height_hr = height_hr
+        self.width_hr = width_hr
+        self.height_lr = int(height_hr / scale)
+        self.width_lr = int(width_hr / scale)
+        self.scale = scale
+        self.crops_per_image = crops_per_image
+        self.channels = channels
+        self.colorspace = colorspace
+        if num_parallel_calls is None:
+            num_parallel_calls = getattr(tf.data.experimental, 'AUTOTUNE', os.cpu_count())
+        self.num_parallel_calls = num_parallel_calls
+        self.prefetch = prefetch
+        self.border = border
+        self.pre_upscale = pre_upscale
+
+        # Same file list as the Sequence loader
+        loader = DataLoader(datapath, batch_size, height_hr, width_hr, scale, crops_per_image, 'i', channels, colorspace)
+        self.img_paths = loader.img_paths
+        self.total_imgs = loader.total_imgs
+
+        self.session = K.get_session()
+        with self.session.graph.as_default():
+            self.dataset = self.build_dataset()
+            self.next_batch = tf.compat.v1.data.make_one_shot_iterator(self.dataset).get_next()
+
+    def decode(self, path):
+        data = tf.io.read_file(path)
+        try:
+            img = tf.image.decode_image(data, channels=3, expand_animations=False)
+        except TypeError:
+            # if you have older version of tensorflow
+            img = tf.image.decode_image(data, channels=3)
+        img.set_shape([None, None, 3])
+        if self.colorspace == 'YCbCr':
+            img = rgb_to_ycbcr(img)
+        return img
+
+    def crop(self, img):
+        return tf.stack([tf.image.random_crop(img, [self.height_hr, self.width_hr, 3])
+                         for _ in range(self.crops_per_image)])
+
+    def degrade(self, img_hr):
+        """Bicubic down and up sampling with cv2, as in DataLoader.load_batch_image"""
+        def resize(img):
+            img_lr = cv2.resize(img, (self.width_lr, self.height_lr), interpolation = cv2.INTER_CUBIC)
+            if not self.pre_upscale:
+                return img_lr
+            return cv2.resize(img_lr, (self.width_hr, self.height_hr), interpolation = cv2.INTER_CUBIC)
+        img_lr = tf.compat.v1.py_func(resize, [img_hr], tf.uint8, stateful=False)
+        if self.pre_upscale:
+            img_lr.set_shape([self.height_hr, self.width_hr, 3])
+        else:
+            img_lr.set_shape([self.height_lr, self.width_lr, 3])
+        img_lr = tf.cast(img_lr[:, :, :self.channels], tf.float32) / 255.
+        border = self.border
+        img_hr = img_hr[border:self.height_hr-border, border:self.width_hr-border, :self.channels]
+        img_hr = tf.cast(img_hr, tf.float32) / 255.
+        return img_lr, img_hr
+
+    def build_dataset(self):
+        dataset = tf.data.Dataset.from_tensor_slices(tf.constant(self.img_paths))
+        dataset = dataset.shuffle(len(self.img_paths)).repeat()
+        dataset = dataset.map(self.decode, num_parallel_calls=self.num_parallel_calls)
+        dataset = dataset.map(self.crop, num_parallel_calls=self.num_parallel_calls)
+        # Unreadable images or images smaller than the crop are skipped
+        dataset = dataset.apply(tf.data.experimental.ignore_errors())
+        dataset = dataset.flat_map(tf.data.Dataset.from_tensor_slices)
+        dataset = dataset.map(self.degrade, num_parallel_calls=self.num_parallel_calls)
+        dataset = dataset.batch(self.batch_size, drop_remainder=True)
+        return dataset.prefetch(self.prefetch)
+
+    def __len__(self):
+        return int(self.total_imgs / float(self.batch_size))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.session.run(self.next_batch)
+
+    next = __next__
@@ -5,23 +5,440 @@ import math
 import numpy as np
 import cv2
 import glob
-import imageio
+import shutil
+import hashlib
+import tempfile
+import json
+import bisect
+import threading
 from PIL import Image
 from random import choice
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from keras.utils import Sequence
-import matplotlib.pyplot as plt
-from keras import backend as K
-from keras.layers import Lambda, Input
-from keras.models import Model
-import tensorflow as tf
 from subprocess import Popen, PIPE
+from multiprocessing import Manager
 from timeit import default_timer as timer
-from losses import psnr2 as psnr
+
+
+class ImageCache():
+    """Decoded uint8 images shared between the DataLoader workers.
+    Arrays are stored as .npy files in a shared directory (tmpfs when available)
+    and indexed by a manager process, so forked workers see the same entries.
+    Least recently used images are evicted when the byte budget is exceeded.
+    """
+    def __init__(self, max_bytes, cache_dir=None):
+        """
+        :param int max_bytes: Budget in bytes of the decoded images kept in the cache
+        :param string cache_dir: Folder to store decoded images, a temporary one if None
+        """
+        self.max_bytes = int(max_bytes)
+        if cache_dir is None:
+            shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            cache_dir = tempfile.mkdtemp(prefix='srcnn_cache_', dir=shm)
+        elif not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+
+        # Index and counters live in a manager process to be shared by workers
+        self.manager = Manager()
+        self.index = self.manager.dict()
+        self.counters = self.manager.dict(hits=0, misses=0, evictions=0, bytes=0, tick=0)
+        self.lock = self.manager.Lock()
+
+    def __getstate__(self):
+        # The manager itself can not be pickled, its proxies can
+        state = self.__dict__.copy()
+        state['manager'] = None
+        return state
+
+    def filename(self, key):
+        return os.path.join(self.cache_dir, hashlib.md5(key.encode('utf-8')).hexdigest() + '.npy')
+
+    def get(self, path, colorspace='RGB'):
+        """Return the decoded image of path, decoding and caching it on a miss"""
+        key = '{}|{}'.format(path, colorspace)
+        with self.lock:
+            hit = key in self.index
+            if hit:
+                self.counters['tick'] += 1
+                self.index[key] = (self.index[key][0], self.counters['tick'])
+                self.counters['hits'] += 1
+            else:
+                self.counters['misses'] += 1
+        if hit:
+            try:
+                return np.load(self.filename(key), mmap_mode='r')
+            except (IOError, OSError, ValueError):
+                # Evicted by another worker meanwhile
+                pass
+        img = DataLoader.load_img(path, colorspace)
+        self.put(key, img)
+        return img
+
+    def put(self, key, img):
+        if img.nbytes > self.max_bytes:
+            return
+        filename = self.filename(key)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(img, dtype=np.uint8))
+        os.rename(tmp, filename)
+        with self.lock:
+            if key in self.index:
+                return
+            self.counters['tick'] += 1
+            self.index[key] = (img.nbytes, self.counters['tick'])
+            self.counters['bytes'] += img.nbytes
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used images until under budget (lock must be held)"""
+        if self.counters['bytes'] <= self.max_bytes:
+            return
+        entries = sorted(self.index.items(), key=lambda item: item[1][1])
+        total = self.counters['bytes']
+        evictions = 0
+        for key, (nbytes, _) in entries:
+            if total <= self.max_bytes:
+                break
+            del self.index[key]
+            try:
+                os.remove(self.filename(key))
+            except OSError:
+                pass
+            total -= nbytes
+            evictions += 1
+        self.counters['bytes'] = total
+        self.counters['evictions'] += evictions
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.index)
+        del stats['tick']
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / float(lookups) if lookups else 0.
+        return stats
+
+    def close(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+
+class LoaderProfile():
+    """Per-stage cumulative time, decoded bytes, failures and images per batch of a DataLoader.
+    Each process accumulates locally and publishes its totals to a manager dict after
+    every batch, so stats() sums the worker processes of fit_generator.
+    Stages: read (decode or seek), convert (video colorspace), crop, degrade (the two
+    resizes) and scale (conversion into the batch arrays).
+    decoded_bytes is the uncompressed size of the images and frames entering the batches,
+    whether decoded from disk or taken from the cache, not the bytes read from disk.
+    """
+    STAGES = ['read', 'convert', 'crop', 'degrade', 'scale']
+    COUNTERS = ['batches', 'images', 'crops', 'decoded_bytes', 'failures']
+
+    def __init__(self):
+        self.manager = Manager()
+        self.workers = self.manager.dict()
+        self.local = None
+        self.pid = None
+
+    def __getstate__(self):
+        # The manager itself can not be pickled, its proxies can
+        state = self.__dict__.copy()
+        state['manager'] = None
+        state['local'] = None
+        return state
+
+    def counters(self):
+        """Totals of this process, reset in each new worker"""
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = dict.fromkeys(self.COUNTERS + self.STAGES, 0)
+        return self.local
+
+    @contextmanager
+    def stage(self, name):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.counters()[name] += timer() - start
+
+    def add(self, key, value=1):
+        self.counters()[key] += value
+
+    def flush(self):
+        self.workers[os.getpid()] = dict(self.counters())
+
+    def stats(self):
+        """Totals over the processes, with the stage times per batch and images per batch"""
+        stats = dict.fromkeys(self.COUNTERS + self.STAGES, 0)
+        workers = self.workers.values()
+        for counters in workers:
+            for key, value in counters.items():
+                stats[key] += value
+        stats['workers'] = len(workers)
+        batches = float(max(stats['batches'], 1))
+        stats['images_per_batch'] = stats['images'] / batches
+        for name in self.STAGES:
+            stats[name + '_per_batch'] = stats[name] / batches
+        return stats
+
+    def write_summary(self, writer, step):
+        """Write stats() as scalars under loader/ with a TensorBoard summary writer"""
+        import tensorflow as tf
+        summary = tf.Summary(value=[tf.Summary.Value(tag='loader/' + key, simple_value=float(value))
+                                    for key, value in sorted(self.stats().items())])
+        writer.add_summary(summary, step)
+        writer.flush()
+
+    def close(self):
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+
+VIDEO_INDEX_VERSION = 1
+
+
+def build_video_index(videopath):
+    """Scan a video once for its frame count, fps, resolution and keyframe positions.
+    Keyframes come from ffprobe packet flags; without ffprobe the frames are counted
+    with OpenCV and no keyframes are recorded, so seeks fall back to cap.set."""
+    cap = cv2.VideoCapture(videopath)
+    if not cap.isOpened():
+        raise IOError("Error to open video: {}".format(videopath))
+    index = {
+        'version': VIDEO_INDEX_VERSION,
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'frames': 0,
+        'keyframes': []
+    }
+    try:
+        p = Popen(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                   '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', videopath],
+                  stdout=PIPE, stderr=PIPE)
+        out, _ = p.communicate()
+        if p.returncode != 0:
+            raise OSError(p.returncode)
+        packets = []
+        for n, line in enumerate(out.decode('utf-8').splitlines()):
+            fields = line.strip().split(',')
+            if len(fields) < 2:
+                continue
+            try:
+                pts = float(fields[0])
+            except ValueError:
+                # Raw streams (e.g. .264) have no pts, keep decode order
+                pts = float(n)
+            packets.append((pts, 'K' in fields[1]))
+        # Frame numbers are in presentation order
+        packets.sort(key=lambda packet: packet[0])
+        index['frames'] = len(packets)
+        index['keyframes'] = [n for n, (_, key) in enumerate(packets) if key]
+    except OSError:
+        index['frames'] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if index['frames'] <= 0:
+            count = 0
+            while cap.grab():
+                count += 1
+            index['frames'] = count
+    cap.release()
+    return index
+
+
+def load_video_index(videopath):
+    """Return the sidecar index of a video (videopath + '.index.json'),
+    rebuilding it when missing or when the video size or mtime changed"""
+    stat = os.stat(videopath)
+    sidecar = videopath + '.index.json'
+    try:
+        with open(sidecar) as f:
+            index = json.load(f)
+        if (index.get('version') == VIDEO_INDEX_VERSION and index['size'] == stat.st_size
+                and index['mtime'] == stat.st_mtime):
+            return index
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    index = build_video_index(videopath)
+    index['size'] = stat.st_size
+    index['mtime'] = stat.st_mtime
+    # Written aside and renamed, workers indexing the same video never read a partial file.
+    # The temporary name keeps the .index.json suffix so the dataset listings skip it
+    tmp = os.path.join(os.path.dirname(sidecar), '.{}.{}.{}.index.json'.format(
+        os.path.basename(videopath), os.getpid(), threading.get_ident()))
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, sidecar)
+    except (IOError, OSError) as e:
+        print(">> Could not write video index {}: {}".format(sidecar, e))
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return index
+
+
+def seek_frame(cap, pos, frame, keyframes=None):
+    """Position cap so the next read returns frame, given the current position pos.
+    Seeks to the nearest keyframe at or before frame and grabs forward from it,
+    or only grabs forward when pos already lies between that keyframe and frame.
+    Returns the new position."""
+    if pos == frame:
+        return pos
+    if not keyframes:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        return frame
+    key = keyframes[max(bisect.bisect_right(keyframes, frame) - 1, 0)]
+    if not key <= pos < frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+        pos = key
+    while pos < frame and cap.grab():
+        pos += 1
+    return pos
+
+
+class VideoDecoderPool():
+    """Open cv2.VideoCapture objects kept by each worker process or thread.
+    Decoders are keyed by video path and the least recently used one
+    is released when more than size videos are open.
+    """
+    def __init__(self, size=2):
+        self.size = size
+        self.pid = None
+        self.local = None
+
+    def __getstate__(self):
+        # Captures can not cross process boundaries, workers open their own
+        state = self.__dict__.copy()
+        state['pid'] = None
+        state['local'] = None
+        return state
+
+    @property
+    def decoders(self):
+        """Decoders of the calling thread, a capture can not be shared by threads"""
+        if self.pid != os.getpid():
+            # Forked from another process: its captures are not ours to use
+            self.pid = os.getpid()
+            self.local = threading.local()
+        if not hasattr(self.local, 'decoders'):
+            self.local.decoders = OrderedDict()
+        return self.local.decoders
+
+    def get(self, path):
+        """Return the decoder entry {'cap', 'frames', 'keyframes', 'pos'} of path, opening it if needed"""
+        decoders = self.decoders
+        if path in decoders:
+            decoders.move_to_end(path)
+            return decoders[path]
+        index = load_video_index(path)
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError("Error to open video: {}".format(path))
+        entry = {'cap': cap, 'frames': index['frames'], 'keyframes': index['keyframes'], 'pos': 0}
+        decoders[path] = entry
+        while len(decoders) > self.size:
+            _, old = decoders.popitem(last=False)
+            old['cap'].release()
+        return entry
+
+    def read(self, entry, start, n_frames=1):
+        """Read n_frames consecutive frames from start, seeking only when needed"""
+        cap = entry['cap']
+        entry['pos'] = seek_frame(cap, entry['pos'], start, entry['keyframes'])
+        frames = []
+        for _ in range(n_frames):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            entry['pos'] += 1
+            frames.append(frame)
+        return frames
+
+    def close(self):
+        decoders = self.decoders
+        for entry in decoders.values():
+            entry['cap'].release()
+        decoders.clear()
+
+
+class BicubicResizer():
+    """TensorFlow bicubic resize with one graph op per (image shape, output size), built
+    on first use and reused for any number of images, in a graph and session of its own
+    so the Keras session is left alone. Each process builds its own ops and threads share them.
+    TensorFlow does not survive a fork once it runs, so use it from threads or spawned processes.
+    """
+    def __init__(self, threads=1):
+        """
+        :param int threads: intra-op threads of the resize session
+        """
+        self.threads = threads
+        self.pid = None
+        self.ops = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sessions can not cross process boundaries, workers build their own
+        state = self.__dict__.copy()
+        state['pid'] = None
+        state['ops'] = {}
+        state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def op(self, shape, size):
+        with self.lock:
+            return self.build_op(shape, size)
+
+    def build_op(self, shape, size):
+        import tensorflow as tf
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.graph = tf.Graph()
+            config = tf.ConfigProto(intra_op_parallelism_threads=self.threads, inter_op_parallelism_threads=1,
+                                    device_count={'GPU': 0})
+            self.session = tf.Session(graph=self.graph, config=config)
+            self.ops = {}
+        key = (shape, size)
+        if key not in self.ops:
+            with self.graph.as_default():
+                inp = tf.placeholder(tf.float32, (None,) + shape)
+                try:
+                    out = tf.image.resize_bicubic(inp, size, half_pixel_centers=True)
+                except TypeError:
+                    # if you have older version of tensorflow
+                    out = tf.image.resize_bicubic(inp, size)
+                out = tf.cast(tf.round(tf.clip_by_value(out, 0., 255.)), tf.uint8)
+            self.ops[key] = (inp, out)
+        return self.ops[key]
+
+    def resize(self, imgs, size):
+        """Resize a uint8 batch (n, h, w, c) to size (height, width)"""
+        imgs = np.asarray(imgs)
+        inp, out = self.op(imgs.shape[1:], tuple(size))
+        return self.session.run(out, {inp: imgs})
+
+    def downscale(self, imgs, scale):
+        return self.resize(imgs, (imgs.shape[1]//scale, imgs.shape[2]//scale))
+
+    def upscale(self, imgs, scale):
+        return self.resize(imgs, (imgs.shape[1]*scale, imgs.shape[2]*scale))
 
 
 class DataLoader(Sequence):
     def __init__(self, datapath, batch_size, height_hr, width_hr, 
-         scale, crops_per_image, media_type,channels=3,colorspace='RGB'):
+         scale, crops_per_image, media_type,channels=3,colorspace='RGB',cache=None,
+         video_decoders=0, frames_per_seek=1, dtype='float32', border=6, pre_upscale=True, profile=None,
+         degradation='cv2'):
         """        
         :param string datapath: filepath to training images
         :param int height_hr: Height of high-resolution images
@@ -29,6 +446,14 @@ class DataLoader(Sequence):
         :param int height_hr: Height of low-resolution images
         :param int width_hr: Width of low-resolution images
         :param int scale: Upscaling factor
+        :param ImageCache cache: Shared cache of decoded images, None to decode on every load
+        :param int video_decoders: Open videos kept per worker, 0 to reopen the video for every frame
+        :param int frames_per_seek: Consecutive frames read after each seek when video_decoders is set
+        :param string dtype: dtype of training batches, 'float32' or 'float64'
+        :param int border: Pixels per side trimmed from HR targets, the valid-padding border of the model
+        :param bool pre_upscale: Bicubic upscale LR inputs back to HR size (SRCNN), False to keep them in LR size (ESPCN)
+        :param LoaderProfile profile: Records stage times, decoded bytes and failures of the training batches, None to disable
+        :param string degradation: Bicubic resize of the degradation, 'cv2' or 'tf' (BicubicResizer, as the in-graph upscale of SRCNN.build_inference_model)
         """
 
         # Store the datapath
@@ -45,6 +470,23 @@ class DataLoader(Sequence):
         self.media_type  = media_type
         self.time_step=1
         self.total_imgs = None
+        self.cache = cache
+        self.frames_per_seek = frames_per_seek
+        self.decoders = VideoDecoderPool(video_decoders) if video_decoders else None
+        self.video_indexes = {}
+        if dtype not in ['float32', 'float64']:
+            raise ValueError('Dtype must be either float32 or float64. You chose {}'.format(dtype))
+        self.dtype = np.dtype(dtype)
+        self.border = border
+        self.pre_upscale = pre_upscale
+        self.profile = profile
+        if degradation not in ['cv2', 'tf']:
+            raise ValueError('Degradation must be either cv2 or tf. You chose {}'.format(degradation))
+        self.resizer = BicubicResizer() if degradation == 'tf' else None
+        self.buffers = None
+        self.pid = os.getpid()
+        self.rng = None
+        self.rng_pid = None
         
         # Options for resizing
         self.options = [Image.NEAREST, Image.BILINEAR, Image.BICUBIC, Image.LANCZOS]
@@ -57,18 +499,18 @@ class DataLoader(Sequence):
     
     def get_paths(self):
         for dirpath, _, filenames in os.walk(self.datapath):
-            for filename in [f for f in filenames if any(filetype in f.lower() for filetype in ['jpeg', 'png', 'jpg','mp4','264','webm','wma'])]:
+            for filename in [f for f in filenames if any(filetype in f.lower() for filetype in ['jpeg', 'png', 'jpg','mp4','264','webm','wma']) and not f.endswith('.index.json')]:
                 self.img_paths.append(os.path.join(dirpath, filename))
         self.total_imgs = len(self.img_paths)
         print(">> Found {} images in dataset".format(self.total_imgs))
     
-    def random_crop(self, img, random_crop_size):
+    def random_crop(self, img, random_crop_size, rng=np.random):
         # Note: image_data_format is 'channel_last'
         assert img.shape[2] == 3
         height, width = img.shape[0], img.shape[1]
         dy, dx = random_crop_size
-        x = np.random.randint(0, width - dx + 1)
-        y = np.random.randint(0, height - dy + 1)
+        x = rng.randint(0, width - dx + 1)
+        y = rng.randint(0, height - dy + 1)
         return img[y:(y+dy), x:(x+dx), :]
 
     def fix_crop(self, img, dy, dx, y, x):
@@ -117,10 +559,11 @@ class DataLoader(Sequence):
         return total
 
 
-    def get_random_frames(self,n_fms=1,cap=None,time_step=1):
+    def get_random_frames(self,n_fms=1,cap=None,time_step=1,t_frames=None):
         """Get random number of video frames"""
         np.random.seed(int(1000000*(timer()%1)))
-        t_frames = self.count_frames(cap)
+        if t_frames is None:
+            t_frames = self.count_frames(cap)
         if(time_step==1):
             choiced_frames = np.random.randint(t_frames, size=n_fms)
         else:
@@ -136,15 +579,28 @@ class DataLoader(Sequence):
             img = img.convert('RGB')     
         return np.array(img)
 
+    def read_img(self, path):
+        """Load an image through the shared cache when there is one"""
+        if self.cache is not None:
+            return self.cache.get(path, self.colorspace)
+        return self.load_img(path, self.colorspace)
+
+
+    def video_index(self, videopath):
+        """Sidecar index of a video, loaded once per process"""
+        if videopath not in self.video_indexes:
+            self.video_indexes[videopath] = load_video_index(videopath)
+        return self.video_indexes[videopath]
 
     def load_frame(self,videopath,time_step=1,colorspace='YCbCr'):
         """Get n_imgs random frames from the video"""
+        index = self.video_index(videopath)
         cap = cv2.VideoCapture(videopath)
         if(not cap.isOpened()):
             print("Error to open video: ",videopath)
             return -1 
-        choiced_frame=self.get_random_frames(1,cap,time_step)
-        cap.set(1,choiced_frame)
+        choiced_frame=self.get_random_frames(1,cap,time_step,t_frames=index['frames'])[0]
+        seek_frame(cap, 0, choiced_frame, index['keyframes'])
         frames = []
         for i in list(range(time_step)):
             ret, frame = cap.read()
@@ -161,17 +617,12 @@ class DataLoader(Sequence):
 
 
     def resize(self,shape,scale,image):
-    
-        # 3 channel images of arbitrary shape
-        inp = Input(shape=shape)
-        try:
-            out = Lambda(lambda image: K.tf.image.resize_bicubic(image, (shape[0]//scale, shape[1]//scale)))(inp)
-        except :
-            # if you have older version of tensorflow
-            out = Lambda(lambda image: K.tf.image.resize_bicubic(image, shape[0]//scale, shape[1]//scale))(inp)
-        model = Model(inputs=inp, outputs=out)
-        out = model.predict(image[np.newaxis, ...])
-        return np.squeeze(out, axis=0).astype(np.uint8) 
+        """TF bicubic downscale of an image, or of a batch of images of the same shape"""
+        if self.resizer is None:
+            self.resizer = BicubicResizer()
+        if image.ndim == len(shape):
+            return self.resizer.downscale(image[np.newaxis, ...], scale)[0]
+        return self.resizer.downscale(image, scale)
    
     
     def __len__(self):
@@ -186,6 +637,8 @@ class DataLoader(Sequence):
         if(self.media_type=='i'):
             #print("1. Media type image")
             imgs_lr, imgs_hr = self.load_batch_image(idx, img_paths=img_paths, training=training,bicubic=bicubic)
+        elif(self.media_type=='v' and self.decoders is not None and training and img_paths is None):
+            imgs_lr, imgs_hr = self.load_batch_video_pool(idx)
         elif(self.media_type=='v' and os.path.isdir(self.datapath)):
             #print("2. Media type video folder")
             imgs_lr, imgs_hr = self.load_batch_video(idx, img_paths=None, training=training, bicubic=bicubic)
@@ -197,6 +650,183 @@ class DataLoader(Sequence):
         return imgs_lr, imgs_hr
     
 
+    def __getstate__(self):
+        # Batch buffers are allocated by each worker
+        state = self.__dict__.copy()
+        state['buffers'] = None
+        return state
+
+    def batch_buffers(self):
+        """Training batch arrays (lr, hr) in self.dtype.
+        Worker processes reuse theirs across calls since batches are pickled to the parent;
+        in the parent process batches may still be queued, so fresh arrays are returned."""
+        if self.buffers is not None and os.getpid() != self.pid:
+            return self.buffers
+        lr_size = (self.height_hr, self.width_hr) if self.pre_upscale else (self.height_lr, self.width_lr)
+        buffers = (
+            np.empty((self.batch_size,) + lr_size + (self.channels,), dtype=self.dtype),
+            np.empty((self.batch_size, self.height_hr-2*self.border, self.width_hr-2*self.border, self.channels), dtype=self.dtype))
+        if os.getpid() != self.pid:
+            self.buffers = buffers
+        return buffers
+
+    def random_state(self):
+        """Random generator of the training crops, reseeded from the OS in each worker process:
+        forked workers inherit the numpy global state and would draw the same frames and crops"""
+        if self.rng_pid != os.getpid():
+            self.rng_pid = os.getpid()
+            self.rng = np.random.RandomState()
+        return self.rng
+
+    def stage(self, name):
+        """Times a loading stage when profiling"""
+        return self.profile.stage(name) if self.profile is not None else nullcontext()
+
+    def count(self, key, value=1):
+        if self.profile is not None:
+            self.profile.add(key, value)
+
+    def end_batch(self, crops):
+        if self.profile is not None:
+            self.profile.add('batches')
+            self.profile.add('crops', crops)
+            self.profile.flush()
+
+    @staticmethod
+    def crop_border(img, border):
+        return img[border:img.shape[0]-border, border:img.shape[1]-border]
+
+    def degrade(self, img_hr):
+        """Bicubic degradation of a uint8 HR image, returns the (lr, hr) pair fed to the model:
+        the LR image upscaled back to HR size and the HR target trimmed by the model border,
+        or the LR image and the HR image cut to a multiple of the scale without pre-upscaling"""
+        if self.resizer is not None:
+            imgs_lr, imgs_hr = self.degrade_batch([img_hr])
+            return imgs_lr[0], imgs_hr[0]
+        height, width = img_hr.shape[0], img_hr.shape[1]
+        lr_shape = (int(width/self.scale), int(height/self.scale))
+        if not self.pre_upscale:
+            img_hr = img_hr[:lr_shape[1]*self.scale, :lr_shape[0]*self.scale]
+        img_lr = cv2.resize(img_hr, lr_shape, interpolation = cv2.INTER_CUBIC)
+        if self.pre_upscale:
+            img_lr = cv2.resize(img_lr, (width, height), interpolation = cv2.INTER_CUBIC)
+        if img_lr.ndim == 2:
+            img_lr = img_lr[:, :, np.newaxis]
+        return img_lr, self.crop_border(img_hr, self.border)
+
+    def degrade_batch(self, crops_hr):
+        """degrade() of a list of uint8 HR crops of the same shape, returned as (n, h, w, c) arrays.
+        The tensorflow resizer degrades the whole list with one resize per step."""
+        if self.resizer is None:
+            pairs = [self.degrade(img_hr) for img_hr in crops_hr]
+            return np.stack([img_lr for img_lr, _ in pairs]), np.stack([img_hr for _, img_hr in pairs])
+        imgs_hr = np.stack(crops_hr)
+        if imgs_hr.ndim == 3:
+            imgs_hr = imgs_hr[:, :, :, np.newaxis]
+        height, width = imgs_hr.shape[1], imgs_hr.shape[2]
+        lr_shape = (int(height/self.scale), int(width/self.scale))
+        if not self.pre_upscale:
+            imgs_hr = imgs_hr[:, :lr_shape[0]*self.scale, :lr_shape[1]*self.scale]
+        imgs_lr = self.resizer.resize(imgs_hr, lr_shape)
+        if self.pre_upscale:
+            imgs_lr = self.resizer.resize(imgs_lr, (height, width))
+        b = self.border
+        return imgs_lr, imgs_hr[:, b:imgs_hr.shape[1]-b, b:imgs_hr.shape[2]-b]
+
+    def bicubic_baseline(self, img_lr):
+        """Bicubic HR estimate, aligned with the model output, of an LR input"""
+        if self.pre_upscale:
+            return self.crop_border(img_lr, self.border)
+        img = cv2.resize(img_lr, (img_lr.shape[1]*self.scale, img_lr.shape[0]*self.scale), interpolation = cv2.INTER_CUBIC)
+        return img[:, :, np.newaxis] if img.ndim == 2 else img
+
+    def store_crops(self, imgs_lr, imgs_hr, crops_hr):
+        """Degrade the uint8 HR crops of a batch and write the scaled pairs into the batch arrays"""
+        if not crops_hr:
+            return
+        n = len(crops_hr)
+        with self.stage('degrade'):
+            crops_lr, crops_hr = self.degrade_batch(crops_hr)
+        with self.stage('scale'):
+            np.divide(crops_hr[..., :self.channels], 255., out=imgs_hr[:n], dtype=self.dtype)
+            np.divide(crops_lr[..., :self.channels], 255., out=imgs_lr[:n], dtype=self.dtype)
+
+    def load_batch_crops(self, idx=0):
+        """Loads a training batch of random crops straight into the batch arrays"""
+        imgs_lr, imgs_hr = self.batch_buffers()
+        rng = self.random_state()
+        cur_idx = idx*self.batch_size
+        crops = []
+        while len(crops) < self.batch_size:
+            if cur_idx >= self.total_imgs:
+                cur_idx = 0
+            try:
+                with self.stage('read'):
+                    img = self.read_img(self.img_paths[cur_idx])
+                self.count('images')
+                self.count('decoded_bytes', img.nbytes)
+                if img.shape[0] < self.height_hr or img.shape[1] < self.width_hr:
+                    raise ValueError(">> {} is smaller than the {}x{} crops".format(
+                        self.img_paths[cur_idx], self.width_hr, self.height_hr))
+                for i in range(self.crops_per_image):
+                    if len(crops) >= self.batch_size:
+                        break
+                    with self.stage('crop'):
+                        crops.append(self.random_crop(img, (self.height_hr, self.width_hr), rng))
+            except Exception as e:
+                print(e)
+                self.count('failures')
+            finally:
+                cur_idx += 1
+        self.store_crops(imgs_lr, imgs_hr, crops)
+        self.end_batch(len(crops))
+        return imgs_lr, imgs_hr
+
+    def load_batch_video_pool(self, idx=0):
+        """Loads a training batch of crops from videos kept open in the decoder pool.
+        Each seek reads frames_per_seek nearby frames and each frame gives crops_per_image crops."""
+        videos = self.img_paths if os.path.isdir(self.datapath) else [self.datapath]
+        cur_idx = idx*self.batch_size
+        conversion = cv2.COLOR_BGR2YCrCb if self.colorspace == 'YCbCr' else cv2.COLOR_BGR2RGB
+
+        imgs_lr, imgs_hr = self.batch_buffers()
+        rng = self.random_state()
+        crops = []
+        failures = 0
+        while len(crops) < self.batch_size:
+            path = videos[cur_idx % len(videos)]
+            cur_idx += 1
+            try:
+                with self.stage('read'):
+                    entry = self.decoders.get(path)
+                    start = rng.randint(max(entry['frames'] - self.frames_per_seek, 0) + 1)
+                    frames = self.decoders.read(entry, start, self.frames_per_seek)
+                if not frames:
+                    raise IOError(">> Erro to access frames of {}".format(path))
+            except Exception as e:
+                print(e)
+                self.count('failures')
+                failures += 1
+                if failures > len(videos):
+                    raise
+                continue
+
+            for frame in frames:
+                self.count('images')
+                self.count('decoded_bytes', frame.nbytes)
+                with self.stage('convert'):
+                    frame = cv2.cvtColor(frame, conversion)
+                for _ in range(self.crops_per_image):
+                    if len(crops) >= self.batch_size:
+                        break
+                    with self.stage('crop'):
+                        crops.append(self.random_crop(frame, (self.height_hr, self.width_hr), rng))
+
+        self.store_crops(imgs_lr, imgs_hr, crops)
+        self.end_batch(len(crops))
+        return imgs_lr, imgs_hr
+
+
     def load_batch_video(self, idx=0, img_paths=None, training=True, bicubic=True):
         """Loads a batch of frames from videos folder""" 
         # Starting index to look in
@@ -263,7 +893,7 @@ class DataLoader(Sequence):
                 
             except Exception as e:
                 print(e)
-                pass
+                self.count('failures')
             finally:
                 cur_idx += 1
 
@@ -279,6 +909,8 @@ class DataLoader(Sequence):
 
     def load_batch_image(self, idx=0, img_paths=None, training=True, bicubic=False):
         """Loads a batch of images from datapath folder""" 
+        if training and img_paths is None:
+            return self.load_batch_crops(idx)
 
         # Starting index to look in
         cur_idx = 0
@@ -300,9 +932,9 @@ class DataLoader(Sequence):
                 # Load image
                 img_hr = None
                 if img_paths:
-                    img_hr = self.load_img(img_paths[cur_idx],self.colorspace)
+                    img_hr = self.read_img(img_paths[cur_idx])
                 else:
-                    img_hr = self.load_img(self.img_paths[cur_idx],self.colorspace)
+                    img_hr = self.read_img(self.img_paths[cur_idx])
                 # Create HR images to go through
                 img_crops = []
                 if training:
@@ -324,33 +956,19 @@ class DataLoader(Sequence):
                         break   
 
                     # For LR, do bicubic downsampling
-                    lr_shape = (int(img_hr.shape[1]/self.scale), int(img_hr.shape[0]/self.scale))  
-                    hr_shape = (img_hr.shape[1], img_hr.shape[0]) 
-                    
-                    # img_lr = Image.fromarray(img_hr.astype(np.uint8))
-                    # method = Image.BICUBIC if bicubic else choice(self.options)
-                    # img_lr = img_lr.resize(lr_shape, method)
-                    # img_lr = np.array(img_lr.resize(hr_shape, method))
-                    
-                    img_lr = cv2.resize(img_hr,lr_shape, interpolation = cv2.INTER_CUBIC)
-                    img_lr = cv2.resize(img_lr,hr_shape, interpolation = cv2.INTER_CUBIC)
-                    
-                    #img_lr = imresize(img_hr, lr_shape, interp='bicubic')
-                    #img_lr = imresize(img_lr, hr_shape, interp='bicubic')
-
+                    img_lr, img_hr = self.degrade(img_hr)
                     
                     # Scale color values
                     img_hr = self.scale_hr_imgs(img_hr)
                     img_lr = self.scale_lr_imgs(img_lr)
 
                     # Store images
-                    #print(img_hr[6:-6,6:-6,:self.channels].shape,img_lr[:,:,:self.channels].shape)
-                    imgs_hr.append(img_hr[6:-6,6:-6,:self.channels])
+                    imgs_hr.append(img_hr[:,:,:self.channels])
                     imgs_lr.append(img_lr[:,:,:self.channels])
                 
             except Exception as e:
                 print(e)
-                pass
+                self.count('failures')
             finally:
                 cur_idx += 1
 
@@ -364,80 +982,92 @@ class DataLoader(Sequence):
         return imgs_lr, imgs_hr
 
 
-def plot_test_images(model, loader, datapath_test, test_output, epoch, name='SRCNN', channels = 3,colorspace='RGB'):
-    
-    try:   
-        # Get the location of test images
-        test_images = [os.path.join(datapath_test, f) for f in os.listdir(datapath_test) if any(filetype in f.lower() for filetype in ['jpeg','mp4','264', 'png', 'jpg'])]
-        
+def predict_by_shape(model, imgs):
+    """Predict a list of images of mixed sizes with one forward pass per distinct shape"""
+    groups = OrderedDict()
+    for i, img in enumerate(imgs):
+        groups.setdefault(img.shape, []).append(i)
+    preds = [None] * len(imgs)
+    for indexes in groups.values():
+        batch = np.array([imgs[i] for i in indexes])
+        for i, pred in zip(indexes, model.predict(batch, batch_size=len(batch))):
+            preds[i] = pred
+    return preds
+
+
+class TestSet():
+    """Test images loaded, degraded and scored with bicubic once per training run.
+    Keeps the model inputs and the uint8 HR and bicubic images, so an evaluation
+    only runs the forward pass of the model."""
+    def __init__(self, loader, datapath_test, channels=3, colorspace='RGB'):
+        from losses import psnr2 as psnr
+        self.loader = loader
+        self.channels = channels
+        self.colorspace = colorspace
+        self.paths = sorted(os.path.join(datapath_test, f) for f in os.listdir(datapath_test) if any(filetype in f.lower() for filetype in ['jpeg','mp4','264', 'png', 'jpg']) and not f.endswith('.index.json'))
+        self.names = [os.path.basename(path).split(".")[0] for path in self.paths]
+
         # Load the images to perform test on images
-        imgs_lr, imgs_hr = loader.load_batch(img_paths=test_images, training=False, bicubic=True)
-        # Create super resolution and bicubic interpolation images
-        imgs_sr = []
-        srcnn_psnr = []
-        bi_psnr = []
-        for i in range(len(test_images)):
-            
-            pre=np.squeeze(
-                    model.predict(
-                        np.expand_dims(imgs_lr[i], 0),
-                        batch_size=1
-                    ),
-                    axis=0
-                )
-            #pre[pre[:] > 255] = 255
-            #pre[pre[:] < 0] = 0
-            # SRCNN prediction
-            imgs_sr.append(pre)
-
-        # Unscale colors values
-        if channels == 1:
-            imgs_lr = [loader.unscale_lr_imgs(img[6:-6,6:-6,0]).astype(np.uint8) for img in imgs_lr]
-            imgs_hr = [loader.unscale_hr_imgs(img[:,:,0]).astype(np.uint8) for img in imgs_hr]
-            imgs_sr = [loader.unscale_hr_imgs(img[:,:,0]).astype(np.uint8) for img in imgs_sr]
-        else:
-            if(colorspace == 'YCbCr'):
-                imgs_lr = [cv2.cvtColor(loader.unscale_lr_imgs(img[6:-6,6:-6,:channels]).astype(np.uint8), cv2.COLOR_YCrCb2BGR) for img in imgs_lr]
-                imgs_hr = [cv2.cvtColor(loader.unscale_hr_imgs(img).astype(np.uint8), cv2.COLOR_YCrCb2BGR) for img in imgs_hr]
-                imgs_sr = [cv2.cvtColor(loader.unscale_hr_imgs(img).astype(np.uint8), cv2.COLOR_YCrCb2BGR) for img in imgs_sr]
-                
-            else:
-                imgs_lr = [loader.unscale_lr_imgs(img[6:-6,6:-6,:channels]).astype(np.uint8) for img in imgs_lr]
-                imgs_hr = [loader.unscale_hr_imgs(img).astype(np.uint8) for img in imgs_hr]
-                imgs_sr = [loader.unscale_hr_imgs(img).astype(np.uint8) for img in imgs_sr]
+        self.imgs_lr, imgs_hr = loader.load_batch(img_paths=self.paths, training=False, bicubic=True)
+        # Bicubic images aligned with the predictions
+        self.imgs_bicubic = [self.to_uint8(loader.bicubic_baseline(img), lr=True) for img in self.imgs_lr]
+        self.imgs_hr = [self.to_uint8(img) for img in imgs_hr]
+        self.bicubic_psnr = [psnr(img_bi, img_hr, 255.) for img_bi, img_hr in zip(self.imgs_bicubic, self.imgs_hr)]
+
+    def to_uint8(self, img, lr=False):
+        """Unscale a model image to uint8 in the colorspace plotted"""
+        unscale = self.loader.unscale_lr_imgs if lr else self.loader.unscale_hr_imgs
+        if self.channels == 1:
+            return unscale(img[:,:,0]).astype(np.uint8)
+        img = unscale(img[:,:,:self.channels]).astype(np.uint8)
+        if self.colorspace == 'YCbCr':
+            return cv2.cvtColor(img, cv2.COLOR_YCrCb2BGR)
+        return img
+
+    def predict(self, model):
+        """uint8 SR images of the test set"""
+        return [self.to_uint8(img) for img in predict_by_shape(model, self.imgs_lr)]
+
+
+def plot_test_images(model, loader, datapath_test, test_output, epoch, name='SRCNN', channels = 3,colorspace='RGB', test_set=None):
+    """Plot and score the test images, test_set keeps them preprocessed between calls"""
+    # Plotting only dependencies
+    import matplotlib.pyplot as plt
+    from losses import psnr2 as psnr
+
+    try:   
+        if test_set is None:
+            test_set = TestSet(loader, datapath_test, channels, colorspace)
+
+        # SRCNN prediction
+        imgs_sr = test_set.predict(model)
+        srcnn_psnr = [psnr(img_sr, img_hr, 255.) for img_sr, img_hr in zip(imgs_sr, test_set.imgs_hr)]
+        bi_psnr = test_set.bicubic_psnr
         
         # Loop through images
-        for img_hr, img_lr, img_sr, img_path in zip(imgs_hr, imgs_lr, imgs_sr, test_images):
+        for img_hr, img_lr, img_sr, filename, sr_psnr, lr_psnr in zip(test_set.imgs_hr, test_set.imgs_bicubic, imgs_sr, test_set.names, srcnn_psnr, bi_psnr):
 
-            # Get the filename
-            filename = os.path.basename(img_path).split(".")[0]
-	    
-	    
-            # Images and titles
+            # Images, titles and psnr
             images = {
-                'Bicubic': [img_lr, img_hr],  
-                name: [img_sr, img_hr], 
-                'Original': [img_hr,img_hr]
+                'Bicubic': [img_lr, lr_psnr],  
+                name: [img_sr, sr_psnr], 
+                'Original': [img_hr, None]
             }
-            #print(img_sr.shape,img_hr.shape)
-            srcnn_psnr.append(psnr(img_sr,img_hr,255.))
-            #print(img_lr.shape,img_hr.shape)
-            bi_psnr.append(psnr(img_lr,img_hr,255.))
             
-            # Plot the images. Note: rescaling and using squeeze since we are getting batches of size 1                    
+            # Plot the images
             fig, axes = plt.subplots(1, 3, figsize=(40, 10))
-            for i, (title, img) in enumerate(images.items()):
-                axes[i].imshow(img[0])
-                axes[i].set_title("{} - {} {}".format(title, img[0].shape, ("- psnr: "+str(round(psnr(img[0],img[1],255.),2)) if (title == name or title == 'Bicubic' ) else " ")))
-                #axes[i].set_title("{} - {}".format(title, img.shape))
+            for i, (title, (img, value)) in enumerate(images.items()):
+                axes[i].imshow(img, cmap='gray' if img.ndim == 2 else None)
+                axes[i].set_title("{} - {} {}".format(title, img.shape, ("- psnr: "+str(round(value,2)) if value is not None else " ")))
                 axes[i].axis('off')
                 
             plt.suptitle('{} - Epoch: {}'.format(filename, epoch))
             # Save directory                    
             savefile = os.path.join(test_output, "{}-Epoch{}.png".format(filename, epoch))
             fig.savefig(savefile)
-            plt.close()
-            gc.collect()
+            plt.close(fig)
+        gc.collect()
         print('test srcnn psnr: {} - test bi psnr: {}'.format(np.mean(srcnn_psnr),np.mean(bi_psnr)))
+        return {'psnr': np.mean(srcnn_psnr), 'bicubic_psnr': np.mean(bi_psnr)}
     except Exception as e:
         print(e)
@@ -0,0 +1,153 @@
+import os
+import sys
+sys.path.append('libs/')
+import gc
+import json
+from argparse import ArgumentParser
+from keras import backend as K
+from libs.srcnn import SRCNN
+from libs.util import DataLoader
+from libs.quantization import quantize_model, compare_models
+import restore
+
+
+# Sample call
+"""
+# Quantize the 2X, 4X and 8X models to int8, calibrating on the training crops
+python3 quantize.py --scales 2 4 8 --train ../../data/train_large/ --test ../data/benchmarks/Set5/ --weight_path ./model/
+
+# Restore a video with the int8 model
+python3 batch_restore.py --input ../data/videos/ --output ./sr/ --weights ./model/SRCNN_v1_2X.tflite --scale 2
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='Post-training int8 quantization of SRCNN weights')
+
+    parser.add_argument(
+        '-scales', '--scales',
+        type=int, nargs='+', default=[2, 4, 8],
+        help='Upscaling factors to quantize, weights are read from weight_path/modelname_{N}X.h5'
+    )
+
+    parser.add_argument(
+        '-train', '--train',
+        type=str, default='../../data/train_large/',
+        help='Folder with the calibration images'
+    )
+
+    parser.add_argument(
+        '-test', '--test',
+        type=str, default='../data/benchmarks/Set5/',
+        help='Folder with the images to compare the float and the int8 models'
+    )
+
+    parser.add_argument(
+        '-weight_path', '--weight_path',
+        type=str, default='./model/',
+        help='Folder with the weights'
+    )
+
+    parser.add_argument(
+        '-modelname', '--modelname',
+        type=str, default='SRCNN_v1',
+        help='SRCNN'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, default=None,
+        help='Folder to write modelname_{N}X.tflite, default is weight_path'
+    )
+
+    parser.add_argument(
+        '-batches', '--batches',
+        type=int, default=10,
+        help='Calibration batches'
+    )
+
+    parser.add_argument(
+        '-batch_size', '--batch_size',
+        type=int, default=16,
+        help='Calibration batch size'
+    )
+
+    parser.add_argument(
+        '-crops_per_image', '--crops_per_image',
+        type=int, default=4,
+        help='Calibration crops per image'
+    )
+
+    parser.add_argument(
+        '-height_lr', '--height_lr',
+        type=int, default=16,
+        help='height of lr crop'
+    )
+
+    parser.add_argument(
+        '-width_lr', '--width_lr',
+        type=int, default=16,
+        help='width of lr crop'
+    )
+
+    parser.add_argument(
+        '-channels', '--channels',
+        type=int, default=3,
+        help='channels of the models, 1 for luma-only models'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='srcnn upsamples before the network, espcn computes in LR space and upsamples at the end',
+        choices=['srcnn', 'espcn']
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of the models, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-threads', '--threads',
+        type=int, default=None,
+        help='Interpreter threads of the int8 model'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    output = args.output or args.weight_path
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    K.set_learning_phase(0)
+    reports = {}
+    for scale in args.scales:
+        srcnn = SRCNN(height_lr=args.height_lr, width_lr=args.width_lr, upscaling_factor=scale,
+                      channels=args.channels, colorspace=args.colorspace,
+                      architecture=args.architecture, training_mode=False)
+        srcnn.load_weights(os.path.join(args.weight_path, '{}_{}X.h5'.format(args.modelname, scale)))
+        loader = DataLoader(args.train, args.batch_size, srcnn.height_hr, srcnn.width_hr, scale,
+                            args.crops_per_image, 'i', srcnn.channels, srcnn.colorspace,
+                            border=srcnn.border, pre_upscale=srcnn.pre_upscale)
+
+        path = os.path.join(output, '{}_{}X.tflite'.format(args.modelname, scale))
+        quantize_model(srcnn, loader, path, batches=args.batches)
+        qmodel = restore.load_quantized_model(path, threads=args.threads)
+
+        print(">> {}X:".format(scale))
+        reports[scale] = compare_models(srcnn.model, qmodel, loader, args.test)
+        with open(path + '.report.json', 'w') as f:
+            json.dump(reports[scale], f, indent=4)
+
+        del srcnn, loader, qmodel
+        K.clear_session()
+        K.set_learning_phase(0)
+        gc.collect()
+
+    for scale, report in reports.items():
+        print("{}X: {:+.2f}dB, {:.2f}x faster".format(scale, report['psnr_change'], report['speedup']))
@@ -0,0 +1,119 @@
+import os
+import sys
+sys.path.append('libs/')
+from argparse import ArgumentParser
+from keras import backend as K
+from libs.srcnn import SRCNN
+from libs.server import BatchingPredictor, SRServer
+
+
+# Sample call
+"""
+# Serve the 2X, 4X and 8X models on localhost:8000
+python3 serve.py --scales 2 4 8 --weight_path ./model/ --modelname SRCNN_v1
+
+# Request a 2X image and the server statistics
+curl --data-binary @image.png -o image_sr.png 'http://127.0.0.1:8000/sr?scale=2'
+curl http://127.0.0.1:8000/stats
+"""
+
+def parse_args():
+    parser = ArgumentParser(description='SRCNN inference server with dynamic request batching')
+
+    parser.add_argument(
+        '-host', '--host',
+        type=str, default='127.0.0.1',
+        help='Address to listen on'
+    )
+
+    parser.add_argument(
+        '-port', '--port',
+        type=int, default=8000,
+        help='Port to listen on'
+    )
+
+    parser.add_argument(
+        '-scales', '--scales',
+        type=int, nargs='+', default=[2, 4, 8],
+        help='Upscaling factors to serve, weights are loaded from weight_path/modelname_{N}X.h5'
+    )
+
+    parser.add_argument(
+        '-weight_path', '--weight_path',
+        type=str, default='./model/',
+        help='Folder with the weights'
+    )
+
+    parser.add_argument(
+        '-modelname', '--modelname',
+        type=str, default='SRCNN_v1',
+        help='SRCNN'
+    )
+
+    parser.add_argument(
+        '-channels', '--channels',
+        type=int, default=3,
+        help='channels of the models, 1 for luma-only models'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='srcnn upsamples before the network, espcn computes in LR space and upsamples at the end',
+        choices=['srcnn', 'espcn']
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of the models, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-max_batch', '--max_batch',
+        type=int, default=8,
+        help='Most requests predicted in one forward pass'
+    )
+
+    parser.add_argument(
+        '-max_latency', '--max_latency',
+        type=float, default=10.,
+        help='Milliseconds a request may wait for others of the same shape'
+    )
+
+    parser.add_argument(
+        '-tile_size', '--tile_size',
+        type=int, default=None,
+        help='Tile size of the inference, default is full images'
+    )
+
+    return parser.parse_args()
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+
+    models = {}
+    for scale in args.scales:
+        srcnn = SRCNN(upscaling_factor=scale, channels=args.channels, colorspace=args.colorspace,
+                      architecture=args.architecture, training_mode=False)
+        srcnn.load_weights(os.path.join(args.weight_path, '{}_{}X.h5'.format(args.modelname, scale)))
+        # Build the predict function before it is called from the batching thread
+        srcnn.model._make_predict_function()
+        models[scale] = srcnn.model
+
+    predictor = BatchingPredictor(
+        models, graph=K.get_session().graph,
+        max_batch=args.max_batch,
+        max_latency=args.max_latency / 1000.,
+        tile_size=args.tile_size)
+    server = SRServer((args.host, args.port), predictor)
+    print(">> Serving {}X on http://{}:{}".format(', '.join(map(str, args.scales)), args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        predictor.close()
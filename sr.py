@@ -0,0 +1,152 @@
+from timeit import default_timer as timer
+start_import = timer()
+import os
+import sys
+sys.path.append('libs/')
+from argparse import ArgumentParser
+import restore
+end_import = timer()
+
+
+# Sample call
+"""
+# Upscale an image 2X with the NumPy engine, TensorFlow is not imported
+python3 sr.py --input ./lr.png --output ./sr.png --weights ./model/SRCNN_v1_2X.h5 --scale 2
+
+# Upscale a folder of videos with an int8 model from quantize.py
+python3 sr.py --input ../data/videos/ --output ./sr/ --weights ./model/SRCNN_v1_2X.tflite --scale 2 --batch_size 4
+"""
+
+VIDEO_TYPES = ['mp4', '264', 'webm', 'wma']
+IMAGE_TYPES = ['jpeg', 'png', 'jpg']
+
+def parse_args():
+    parser = ArgumentParser(description='Lightweight SRCNN inference on images and videos')
+
+    parser.add_argument(
+        '-input', '--input',
+        type=str, required=True,
+        help='LR image or video, or a folder of them'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        type=str, required=True,
+        help='SR output file, or a folder when the input is a folder'
+    )
+
+    parser.add_argument(
+        '-weights', '--weights',
+        type=str, default='./model/SRCNN_v1_2X.h5',
+        help='Weights of the SRCNN (.h5), a frozen graph (.pb) from export.py or an int8 model (.tflite) from quantize.py'
+    )
+
+    parser.add_argument(
+        '-backend', '--backend',
+        type=str, default='numpy',
+        help='Runtime of .h5 weights, numpy needs no TensorFlow',
+        choices=['numpy', 'keras']
+    )
+
+    parser.add_argument(
+        '-scale', '--scale',
+        type=int, default=2,
+        help='Upscaling factor of the weights'
+    )
+
+    parser.add_argument(
+        '-channels', '--channels',
+        type=int, default=3,
+        help='channels of the keras model, 1 for luma-only models'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='Architecture of the keras model',
+        choices=['srcnn', 'espcn']
+    )
+
+    parser.add_argument(
+        '-colorspace', '--colorspace',
+        type=str, default='RGB',
+        help='Colorspace of the keras model, e.g., RGB or YCbCr'
+    )
+
+    parser.add_argument(
+        '-threads', '--threads',
+        type=int, default=None,
+        help='Inference threads, None for the runtime default'
+    )
+
+    parser.add_argument(
+        '-tile_size', '--tile_size',
+        type=int, default=None,
+        help='Predict output tiles of tile_size x tile_size to bound memory, None for full frames'
+    )
+
+    parser.add_argument(
+        '-batch_size', '--batch_size',
+        type=int, default=1,
+        help='Video frames predicted in each forward pass'
+    )
+
+    parser.add_argument(
+        '-qp', '--qp',
+        type=int, default=8,
+        help='crf of the SR videos, 0 is the best quality and 51 the worst'
+    )
+
+    return parser.parse_args()
+
+
+def load_model(args):
+    """Model of the weights file in the lightest runtime that can run it"""
+    if args.weights.endswith('.pb'):
+        return restore.load_frozen_model(args.weights, threads=args.threads)
+    if args.weights.endswith('.tflite'):
+        return restore.load_quantized_model(args.weights, threads=args.threads)
+    if args.backend == 'numpy':
+        return restore.load_numpy_model(args.weights, scale=args.scale, threads=args.threads)
+    from srcnn import SRCNN
+    srcnn = SRCNN(upscaling_factor=args.scale, channels=args.channels, colorspace=args.colorspace,
+                  architecture=args.architecture, training_mode=False)
+    srcnn.load_weights(weights=args.weights)
+    return srcnn.model
+
+
+def media_type(path):
+    ext = path.lower().split('.')[-1]
+    if ext in VIDEO_TYPES:
+        return 'v'
+    if ext in IMAGE_TYPES:
+        return 'i'
+    return None
+
+
+# Run script
+if __name__ == '__main__':
+    args = parse_args()
+    print(">> Imports: {:.3f}s".format(end_import - start_import))
+
+    if os.path.isdir(args.input):
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+        tasks = [(os.path.join(args.input, f), os.path.join(args.output, f if media_type(f) == 'i' else os.path.splitext(f)[0] + '.mp4'))
+                 for f in sorted(os.listdir(args.input)) if media_type(f) and not f.endswith('.index.json')]
+    else:
+        tasks = [(args.input, args.output)]
+
+    start = timer()
+    model = load_model(args)
+    print(">> Model load ({}): {:.3f}s, tensorflow imported: {}".format(
+        os.path.basename(args.weights), timer() - start, 'tensorflow' in sys.modules))
+
+    for lr_path, sr_path in tasks:
+        print(">> {} -> {}".format(lr_path, sr_path))
+        if media_type(lr_path) == 'v':
+            restore.write_srvideo(model, lr_path, sr_path, args.scale, crf=args.qp,
+                                  batch_size=args.batch_size, tile_size=args.tile_size)
+        else:
+            restore.write_sr_images(model, lr_imagepath=lr_path, sr_imagepath=sr_path,
+                                    scale=args.scale, tile_size=args.tile_size)
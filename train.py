@@ -48,6 +48,12 @@ def parse_args():
         help='Folder with training images'
     )
 
+    parser.add_argument(
+        '-patch_store', '--patch_store',
+        type=str, default=None,
+        help='Folder with a patch store from build_patches.py, used instead of --train'
+    )
+
     parser.add_argument(
         '-steps_per_epoch', '--steps_per_epoch',
         type=int, default=625,
@@ -102,12 +108,69 @@ def parse_args():
         help='How many workers to user for pre-processing'
     )
 
+    parser.add_argument(
+        '-loader', '--loader',
+        type=str, default='sequence',
+        help='Input pipeline: keras Sequence with worker processes or tf.data',
+        choices=['sequence', 'tfdata']
+    )
+
+    parser.add_argument(
+        '-parallel_calls', '--parallel_calls',
+        type=int, default=None,
+        help='Parallel map calls of the tf.data loader, default tuned by tf.data'
+    )
+
+    parser.add_argument(
+        '-degradation', '--degradation',
+        type=str, default='cv2',
+        help='Bicubic resize of the LR degradation, tf matches the in-graph upscale of exported native models',
+        choices=['cv2', 'tf']
+    )
+
+    parser.add_argument(
+        '-sync_test', '--sync_test',
+        action='store_true',
+        help='Plot the test images in the training process, blocking training, instead of a background process'
+    )
+
+    parser.add_argument(
+        '-profile_loader', '--profile_loader',
+        action='store_true',
+        help='Record stage times, decoded bytes and failures of the loader workers and write them to tensorboard'
+    )
+
     parser.add_argument(
         '-max_queue_size', '--max_queue_size',
         type=int, default=5,
         help='Max queue size to workers'
     )
         
+    parser.add_argument(
+        '-cache_size', '--cache_size',
+        type=int, default=0,
+        help='MB of decoded training images shared between workers, 0 to disable the cache'
+    )
+
+    parser.add_argument(
+        '-video_decoders', '--video_decoders',
+        type=int, default=0,
+        help='Videos kept open per worker when media_type is v, 0 to reopen the video for every frame'
+    )
+
+    parser.add_argument(
+        '-frames_per_seek', '--frames_per_seek',
+        type=int, default=1,
+        help='Consecutive frames read after each seek when video_decoders is set'
+    )
+
+    parser.add_argument(
+        '-batch_dtype', '--batch_dtype',
+        type=str, default='float32',
+        help='dtype of the training batches built by the loader workers',
+        choices=['float32', 'float64']
+    )
+
     parser.add_argument(
         '-batch_size', '--batch_size',
         type=int, default=128,
@@ -160,7 +223,14 @@ def parse_args():
     parser.add_argument(
         '-channels', '--channels',
         type=int, default=3,
-        help='channels of images'
+        help='channels of images, 1 to train on Y only (requires --colorspace YCbCr)'
+    )
+
+    parser.add_argument(
+        '-architecture', '--architecture',
+        type=str, default='srcnn',
+        help='srcnn upsamples before the network, espcn computes in LR space and upsamples at the end',
+        choices=['srcnn', 'espcn']
     )
 
     parser.add_argument(
@@ -189,7 +259,7 @@ def reset_layer_names(args):
 
     
     # Load previous model with weights, and re-save weights so that name ordering will match new model
-    prev_model = SRCNN(upscaling_factor=args.scaleFrom)
+    prev_model = SRCNN(upscaling_factor=args.scaleFrom, architecture=args.architecture)
     prev_model.load_weights(BASE)
     prev_model.save_weights(args.weight_path+args.modelname)
 
@@ -238,7 +308,17 @@ if __name__ == '__main__':
         "log_tensorboard_update_freq": args.log_tensorboard_update_freq,
         "workers": args.workers,
         "max_queue_size": args.max_queue_size,
+        "cache_size": args.cache_size,
+        "video_decoders": args.video_decoders,
+        "frames_per_seek": args.frames_per_seek,
+        "batch_dtype": args.batch_dtype,
+        "loader": args.loader,
+        "parallel_calls": args.parallel_calls,
+        "profile_loader": args.profile_loader,
+        "async_test": not args.sync_test,
+        "degradation": args.degradation,
         "datapath_train": args.train,
+        "patch_store": args.patch_store,
         "datapath_validation": args.validation,
         "datapath_test": args.test,
         "log_weight_path": args.weight_path, 
@@ -252,7 +332,8 @@ if __name__ == '__main__':
         "width_lr": args.width_lr, 
         "channels": args.channels,
         "upscaling_factor": args.scale, 
-        "colorspace": args.colorspace        
+        "colorspace": args.colorspace,
+        "architecture": args.architecture
     }
 
     # Generator weight paths
@@ -273,7 +354,8 @@ if __name__ == '__main__':
 
             # Load the properly named weights onto this model and freeze lower-level layers
             srcnn = SRCNN(lr=1e-4,**args_model)
-            srcnn.load_weights(BASE, by_name=True)
+            # The sub-pixel layer of espcn changes shape with the scale
+            srcnn.load_weights(BASE, by_name=True, skip_mismatch=args.architecture == 'espcn')
             model_freeze_layers(args, srcnn)
             model_train(srcnn, args_train, epochs=3)
 